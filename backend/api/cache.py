@@ -0,0 +1,58 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(*parts):
+    return 'version:' + ':'.join(str(part) for part in parts)
+
+
+def get_version(*parts):
+    '''Текущая версия группы кэшированных данных.
+
+    Версии монотонны и не меньше времени изменения в миллисекундах,
+    поэтому вытеснение ключа из кэша не возвращает старые значения.
+    '''
+    key = version_key(*parts)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(parts_list):
+    '''Версии нескольких групп за одно обращение к кэшу.'''
+    keys = {version_key(*parts): parts for parts in parts_list}
+    versions = cache.get_many(keys)
+    for key, parts in keys.items():
+        if key not in versions:
+            versions[key] = get_version(*parts)
+    return {parts: versions[key] for key, parts in keys.items()}
+
+
+def bump_version(*parts):
+    '''Инвалидирует все значения, закэшированные под старой версией.'''
+    version = max(get_version(*parts) + 1, int(time.time() * 1000))
+    cache.set(version_key(*parts), version, timeout=None)
+    return version
+
+
+def bump_versions(parts_list):
+    '''bump_version для нескольких групп за одно обращение к кэшу.'''
+    now = int(time.time() * 1000)
+    versions = {
+        version_key(*parts): max(version + 1, now)
+        for parts, version in get_versions(parts_list).items()
+    }
+    cache.set_many(versions, timeout=None)
+
+
+def bump_version_on_commit(*parts):
+    transaction.on_commit(lambda: bump_version(*parts))
+
+
+def bump_versions_on_commit(parts_list):
+    parts_list = list(parts_list)
+    transaction.on_commit(lambda: bump_versions(parts_list))
@@ -0,0 +1,61 @@
+import hashlib
+import threading
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_version
+
+
+class CatalogCache:
+    '''Отрендеренный JSON справочника в памяти процесса.
+
+    Байты пересобираются только при смене версии справочника, которую
+    сигналы повышают при сохранении или удалении записей.
+    '''
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.entry = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        version = get_version('catalog', self.name)
+        entry = self.entry
+        if entry is not None and entry[0] == version:
+            return entry
+        with self.lock:
+            entry = self.entry
+            if entry is None or entry[0] != version:
+                content = JSONRenderer().render(self.build())
+                etag = '"%s"' % hashlib.md5(content).hexdigest()
+                entry = (version, content, etag)
+                self.entry = entry
+        return entry
+
+    def response(self, request):
+        _, content, etag = self.get()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content,
+                                    content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+def build_tags():
+    from recipes.models import Tag
+
+    from .serializers import TagSerializer
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def build_ingredients():
+    from .search import get_ingredient_index
+    return get_ingredient_index().rows
+
+
+tags_catalog = CatalogCache('tags', build_tags)
+ingredients_catalog = CatalogCache('ingredients', build_ingredients)
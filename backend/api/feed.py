@@ -0,0 +1,45 @@
+from recipes.models import FeedEntry, Recipe
+from user.models import Subscribe
+
+
+class FeedQuerySet:
+    '''Лента подписок для RecipeCursorPagination.
+
+    Рецепты берутся из двух источников, каждый по своему индексу:
+    записи FeedEntry пользователя и неразосланные рецепты авторов,
+    на которых он подписан. Обе выборки ограничиваются размером
+    страницы и сливаются по (pub_date, id). Поддерживается только то,
+    что нужно курсорной пагинации: order_by, filter по pub_date и срез.
+    '''
+
+    def __init__(self, user, ordering=('-pub_date', '-id'), filters=None):
+        self.user = user
+        self.ordering = ordering
+        self.filters = filters or {}
+
+    def order_by(self, *ordering):
+        return FeedQuerySet(self.user, ordering, self.filters)
+
+    def filter(self, **filters):
+        return FeedQuerySet(self.user, self.ordering,
+                            {**self.filters, **filters})
+
+    def __getitem__(self, item):
+        stop = item.stop
+        entries = FeedEntry.objects.filter(
+            user=self.user, **self.filters
+        ).order_by(
+            *(order.replace('id', 'recipe_id') for order in self.ordering)
+        ).values_list('pub_date', 'recipe_id')[:stop]
+        pulled = Recipe.objects.filter(
+            feed_fanout=False,
+            author__in=Subscribe.objects.filter(
+                user=self.user).values('author_id'),
+            **self.filters
+        ).order_by(*self.ordering).values_list('pub_date', 'id')[:stop]
+        rows = sorted(set(entries) | set(pulled),
+                      reverse=self.ordering[0].startswith('-'))[item]
+        recipes = Recipe.objects.select_related('author').in_bulk(
+            [recipe_id for _, recipe_id in rows])
+        return [recipes[recipe_id] for _, recipe_id in rows
+                if recipe_id in recipes]
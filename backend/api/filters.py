@@ -1,10 +1,35 @@
+from django import forms
 from django_filters import FilterSet, filters
 from recipes.models import Recipe, Tag
-from rest_framework.filters import SearchFilter
 
+from .membership import get_membership
+from .search import search_recipes
 
-class IngredientSearchFilter(SearchFilter):
-    search_param = 'name'
+
+class RecipeFilterForm(forms.Form):
+    '''Параметры, которые задают порядок выдачи, нельзя сочетать:
+    последний из них молча перекрыл бы остальные.'''
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cursor = (self.data.get('pagination') == 'cursor'
+                  or 'cursor' in self.data)
+        if cleaned_data.get('search'):
+            # Результаты поиска упорядочены по релевантности.
+            if cleaned_data.get('ordering'):
+                self.add_error(
+                    'ordering', 'Результаты поиска упорядочены по '
+                    'релевантности, ordering с search не используется.')
+            if cursor:
+                self.add_error(
+                    'search', 'Поиск не поддерживает курсорную '
+                    'пагинацию, используйте page.')
+        elif cleaned_data.get('ordering') and cursor:
+            # Курсор кодирует позицию только по (pub_date, id).
+            self.add_error(
+                'ordering', 'Курсорная пагинация поддерживает только '
+                'порядок по дате публикации.')
+        return cleaned_data
 
 
 class RecipeFilter(FilterSet):
@@ -17,19 +42,34 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
+        form = RecipeFilterForm
 
     def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
-        if value and user.is_authenticated:
-            return queryset.filter(favorite_recipe__user=user)
+        membership = get_membership(self.request)
+        if value and membership is not None:
+            return queryset.filter(id__in=membership.favorites)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value and user.is_authenticated:
-            return queryset.filter(purchase__user=user)
-        return
+        membership = get_membership(self.request)
+        if value and membership is not None:
+            return queryset.filter(id__in=membership.cart)
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        # Порядок совпадает с индексом recipe_popular_idx.
+        return queryset.order_by('-favorites_count', '-pub_date', '-id')
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
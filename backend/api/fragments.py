@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_versions
+
+
+def get_fragment_keys(recipes, request):
+    '''Ключи кэша общих для всех пользователей частей рецептов.
+
+    Ключ меняется при изменении рецепта, профиля автора, тегов или
+    ингредиентов; адрес хоста нужен из-за абсолютных ссылок на картинки.
+    Время updated_at не дает закэшировать устаревший объект из памяти,
+    если фоновая обработка картинки успела сохранить рецепт раньше.
+    '''
+    versions = get_versions(
+        [('recipe', recipe.id) for recipe in recipes]
+        + [('profile', recipe.author_id) for recipe in recipes]
+        + [('catalog', 'tags'), ('catalog', 'ingredients')]
+    )
+    host = request.build_absolute_uri('/') if request else ''
+    catalog = (f"{versions[('catalog', 'tags')]}:"
+               f"{versions[('catalog', 'ingredients')]}")
+    return {
+        recipe.id: (
+            f"recipe:{recipe.id}:{versions[('recipe', recipe.id)]}:"
+            f"{recipe.updated_at.timestamp() if recipe.updated_at else ''}:"
+            f"{versions[('profile', recipe.author_id)]}:{catalog}:{host}"
+        )
+        for recipe in recipes
+    }
+
+
+def get_fragments(keys):
+    return cache.get_many(list(keys))
+
+
+def set_fragments(fragments):
+    if fragments:
+        cache.set_many(fragments, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
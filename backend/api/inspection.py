@@ -0,0 +1,151 @@
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework.fields import Field
+
+logger = logging.getLogger(__name__)
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LISTS = re.compile(r'\bIN \((?:\s*(?:%s|\?|NULL)\s*,?)+\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+
+
+class NPlusOneError(Exception):
+    '''Один и тот же запрос выполнен больше QUERY_REPEAT_THRESHOLD раз.'''
+
+
+def fingerprint(sql):
+    '''Форма запроса без значений: литералы заменены на ?,
+    списки IN (...) любой длины совпадают.'''
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = IN_LISTS.sub('IN (...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def get_location():
+    '''Поле сериализатора, в котором выполняется запрос, и первая
+    строка кода проекта в стеке вызовов.'''
+    field = project = None
+    frame = sys._getframe(2)
+    while frame is not None and (field is None or project is None):
+        candidate = frame.f_locals.get('field')
+        if (field is None and isinstance(candidate, Field)
+                and candidate.parent is not None):
+            field = (f'{type(candidate.parent).__name__}.'
+                     f'{candidate.field_name}')
+        filename = frame.f_code.co_filename
+        if (project is None and filename.startswith(str(settings.BASE_DIR))
+                and filename != __file__ and 'site-packages' not in filename):
+            project = (f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                       f'{frame.f_lineno} {frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' '.join(part for part in (field, project) if part) or 'unknown'
+
+
+class QueryInspector:
+    '''Обертка connection.execute_wrapper: считает формы запросов
+    и пишет в лог медленные запросы с планом EXPLAIN.'''
+
+    def __init__(self, threshold=None, slow_ms=None):
+        self.threshold = (settings.QUERY_REPEAT_THRESHOLD
+                          if threshold is None else threshold)
+        self.slow_ms = settings.SLOW_QUERY_MS if slow_ms is None else slow_ms
+        self.shapes = {}
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            shape = fingerprint(sql)
+            entry = self.shapes.setdefault(
+                shape, {'count': 0, 'locations': Counter()})
+            entry['count'] += 1
+            entry['locations'][get_location()] += 1
+            if self.slow_ms and duration >= self.slow_ms and not many:
+                self.log_slow(context['connection'], sql, params, duration)
+
+    def log_slow(self, db, sql, params, duration):
+        plan = ''
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            # Запрос EXPLAIN тоже проходит через обертку, его не считаем.
+            self.explaining = True
+            try:
+                with db.cursor() as cursor:
+                    cursor.execute(
+                        f'{db.ops.explain_query_prefix()} {sql}', params)
+                    plan = '\n'.join(
+                        ' '.join(str(value) for value in row)
+                        for row in cursor.fetchall())
+            except Exception as error:
+                plan = f'EXPLAIN failed: {error}'
+            finally:
+                self.explaining = False
+        logger.warning('Slow query %.1f ms at %s:\n%s\n%s', duration,
+                       get_location(), sql, plan)
+
+    def problems(self):
+        return [
+            (shape, entry) for shape, entry in self.shapes.items()
+            if entry['count'] > self.threshold
+        ]
+
+    def report(self, title=''):
+        lines = []
+        for shape, entry in self.problems():
+            locations = ', '.join(
+                f'{location} ({count})'
+                for location, count in entry['locations'].most_common(3))
+            lines.append(f'{entry["count"]} x {shape[:300]}\n    {locations}')
+        if not lines:
+            return ''
+        return (f'Repeated queries{f" in {title}" if title else ""}:\n'
+                + '\n'.join(lines))
+
+
+@contextmanager
+def inspect_queries(threshold=None, slow_ms=None, mode='raise', title=''):
+    '''Для тестов и бенчмарка: with inspect_queries(): ...
+    бросает NPlusOneError, если запрос повторился больше порога.'''
+    inspector = QueryInspector(threshold, slow_ms)
+    with connection.execute_wrapper(inspector):
+        yield inspector
+    report = inspector.report(title)
+    if report and mode == 'raise':
+        raise NPlusOneError(report)
+    if report and mode == 'log':
+        logger.warning(report)
+
+
+class QueryInspectionMiddleware:
+    '''QUERY_INSPECTION=log пишет повторяющиеся и медленные запросы
+    в лог, raise превращает повторы в ошибку. По умолчанию выключено.'''
+
+    def __init__(self, get_response):
+        if settings.QUERY_INSPECTION not in ('log', 'raise'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with inspect_queries(mode=settings.QUERY_INSPECTION,
+                             title=f'{request.method} {request.path}'):
+            response = self.get_response(request)
+            if response.streaming:
+                # Тело выгрузки собирается здесь, чтобы запросы
+                # итератора попали в проверку.
+                response.streaming_content = list(response.streaming_content)
+        return response
@@ -0,0 +1,300 @@
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from api.inspection import NPlusOneError, inspect_queries
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from recipes.models import FavoriteRecipe, Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from user.models import User
+
+DEFAULT_BUDGETS = os.path.join(settings.BASE_DIR, 'benchmarks',
+                               'budgets.json')
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf'
+         'FcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+def committed(function):
+    '''Выполняет function и ее колбэки transaction.on_commit: прогон
+    идет в откатываемой транзакции, а рассылка ленты, метки версий и
+    кэш Membership должны стоить столько же, сколько в работе.'''
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        return function()
+
+
+def read(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+class Command(BaseCommand):
+    help = ('Benchmark hot API endpoints against the current database and '
+            'check query count, latency and memory budgets')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--only', nargs='+', default=None,
+            help='Run only the named scenarios')
+        parser.add_argument(
+            '--output', default=None,
+            help='Write results as JSON to this file instead of stdout')
+        parser.add_argument('--budgets', default=DEFAULT_BUDGETS)
+        parser.add_argument(
+            '--no-budgets', action='store_true',
+            help='Only record results, do not check budgets')
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError('No recipes found, run manage.py seed first')
+        # Кэш и файлы изолированы, все записи откатываются в конце.
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            ALLOWED_HOSTS=['*'],
+            MEDIA_ROOT=media,
+            SHOPPING_LIST_CACHE_DIR=os.path.join(media, 'shopping_lists'),
+            RECIPE_IMAGE_PROCESSING='queue',
+            FEED_FANOUT_PROCESSING='queue',
+            CACHES={'default': self.get_cache_settings(media)},
+        ):
+            try:
+                with transaction.atomic():
+                    results = self.run(options)
+                    transaction.set_rollback(True)
+            finally:
+                self.clear_cache()
+        report = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'recipes': Recipe.objects.count(),
+                'users': User.objects.count(),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        if not options['no_budgets']:
+            self.check_budgets(results, options['budgets'])
+
+    def get_cache_settings(self, directory):
+        '''Настроенный бэкенд кэша со своим пространством ключей.
+
+        Стоимость обращений к кэшу входит в бюджеты, поэтому бэкенд
+        тот же, что в работе; записи прогона не смешиваются с рабочими.
+        '''
+        config = dict(settings.CACHES['default'])
+        run = f'benchmark-{uuid.uuid4().hex[:12]}'
+        backend = config['BACKEND'].rsplit('.', 1)[-1]
+        if backend == 'FileBasedCache':
+            config['LOCATION'] = os.path.join(directory, 'cache')
+        elif backend == 'LocMemCache':
+            config['LOCATION'] = run
+        else:
+            config['KEY_PREFIX'] = ':'.join(
+                part for part in (config.get('KEY_PREFIX'), run) if part)
+        return config
+
+    def clear_cache(self):
+        '''Удаляет записи прогона. clear() у Redis очистил бы всю базу,
+        поэтому там удаляются только ключи с префиксом прогона.'''
+        cache = caches['default']
+        if isinstance(cache, RedisCache):
+            client = cache._cache.get_client(write=True)
+            keys = list(client.scan_iter(match=cache.make_key('*'),
+                                         count=1000))
+            for start in range(0, len(keys), 1000):
+                client.delete(*keys[start:start + 1000])
+        elif type(cache).__name__ in ('FileBasedCache', 'LocMemCache'):
+            cache.clear()
+        else:
+            self.stderr.write('Benchmark cache keys cannot be listed on '
+                              'this backend and were not deleted')
+
+    def get_user(self):
+        '''Пользователь с самым длинным избранным: худший случай.'''
+        top = FavoriteRecipe.objects.values('user_id').annotate(
+            count=Count('id')).order_by('-count', 'user_id').first()
+        if top is None:
+            return User.objects.order_by('id').first()
+        return User.objects.get(id=top['user_id'])
+
+    def get_scenarios(self, user):
+        anonymous = Client()
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        tag = Tag.objects.order_by('id').first()
+        ingredients = list(Ingredient.objects.order_by('id')[:5])
+        payload = {
+            'ingredients': [{'id': ingredient.id, 'amount': 10}
+                            for ingredient in ingredients],
+            'tags': [tag.id],
+            'image': IMAGE,
+            'name': 'Benchmark',
+            'text': 'Benchmark recipe',
+            'cooking_time': 10,
+        }
+        own = committed(lambda: client.post(
+            '/api/recipes/', payload,
+            content_type='application/json')).json()['id']
+        created = []
+
+        def create():
+            response = client.post('/api/recipes/', payload,
+                                   content_type='application/json')
+            created.append(response.json().get('id'))
+            return response
+
+        def delete_created():
+            Recipe.objects.filter(id__in=created).delete()
+            created.clear()
+
+        toggle = Recipe.objects.exclude(
+            favorite_recipe__user=user).exclude(
+            purchase__user=user).order_by('id').first()
+        return {
+            'recipe_list_anonymous': (
+                lambda: anonymous.get('/api/recipes/'), None),
+            'recipe_list': (lambda: client.get('/api/recipes/'), None),
+            'recipe_list_tags': (
+                lambda: client.get(f'/api/recipes/?tags={tag.slug}'), None),
+            'recipe_list_favorited': (
+                lambda: client.get('/api/recipes/?is_favorited=1'), None),
+            'recipe_list_in_cart': (
+                lambda: client.get('/api/recipes/?is_in_shopping_cart=1'),
+                None),
+            'recipe_list_popular': (
+                lambda: client.get('/api/recipes/?ordering=popular'), None),
+            'recipe_feed': (lambda: client.get('/api/recipes/feed/'), None),
+            'recipe_detail_anonymous': (
+                lambda: anonymous.get(f'/api/recipes/{recipe.id}/'), None),
+            'recipe_detail': (
+                lambda: client.get(f'/api/recipes/{recipe.id}/'), None),
+            'recipe_create': (create, delete_created),
+            'recipe_update': (
+                lambda: client.patch(f'/api/recipes/{own}/', payload,
+                                     content_type='application/json'),
+                None),
+            'ingredient_search': (
+                lambda: client.get('/api/ingredients/?name=мол'), None),
+            'tags': (lambda: client.get('/api/tags/'), None),
+            'subscriptions': (
+                lambda: client.get('/api/users/subscriptions/'), None),
+            'favorite_toggle': (
+                lambda: client.post(f'/api/recipes/{toggle.id}/favorite/'),
+                lambda: client.delete(f'/api/recipes/{toggle.id}/favorite/')),
+            'shopping_cart_toggle': (
+                lambda: client.post(
+                    f'/api/recipes/{toggle.id}/shopping_cart/'),
+                lambda: client.delete(
+                    f'/api/recipes/{toggle.id}/shopping_cart/')),
+            'shopping_list_download': (
+                lambda: client.get('/api/recipes/download_shopping_cart/'),
+                None),
+        }
+
+    def run(self, options):
+        user = self.get_user()
+        scenarios = self.get_scenarios(user)
+        if options['only']:
+            unknown = set(options['only']) - set(scenarios)
+            if unknown:
+                raise CommandError(
+                    f'Unknown scenarios: {", ".join(sorted(unknown))}')
+            scenarios = {name: scenarios[name] for name in options['only']}
+        results = {}
+        for name, (request, cleanup) in scenarios.items():
+            results[name] = self.measure(name, request, cleanup, options)
+            self.stderr.write(
+                f'{name}: {results[name]["queries"]} queries, '
+                f'p50 {results[name]["p50_ms"]} ms, '
+                f'p95 {results[name]["p95_ms"]} ms')
+        return results
+
+    def measure(self, name, request, cleanup, options):
+        def call():
+            response = committed(request)
+            size = len(read(response))
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{response.status_code}: {response.content[:200]}')
+            return size
+
+        for _ in range(options['warmup']):
+            call()
+            if cleanup:
+                committed(cleanup)
+        # Прогон с поиском N+1: повтор одной формы SQL считается ошибкой.
+        try:
+            with inspect_queries(title=name):
+                call()
+        except NPlusOneError as error:
+            raise CommandError(str(error))
+        if cleanup:
+            committed(cleanup)
+        timings = []
+        queries = 0
+        for _ in range(options['iterations']):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                size = call()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(context.captured_queries))
+            if cleanup:
+                committed(cleanup)
+        # Память меряется отдельным прогоном: tracemalloc искажает время.
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        if cleanup:
+            committed(cleanup)
+        return {
+            'queries': queries,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'memory_kb': round(peak / 1024),
+            'response_bytes': size,
+        }
+
+    def check_budgets(self, results, path):
+        with open(path, encoding='utf-8') as file:
+            budgets = json.load(file)
+        failures = [
+            f'{name}.{metric}: {results[name][metric]} > {limit}'
+            for name, budget in budgets.items() if name in results
+            for metric, limit in budget.items()
+            if results[name][metric] > limit
+        ]
+        if failures:
+            raise CommandError('Budgets exceeded:\n' + '\n'.join(failures))
+        self.stderr.write('All budgets met')
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.cache import cache
+from recipes.models import FavoriteRecipe, ShoppingCart
+from user.models import Subscribe
+
+from .cache import bump_version, get_version
+
+MEMBERSHIP_MODELS = {
+    'favorites': (FavoriteRecipe, 'recipe_id'),
+    'cart': (ShoppingCart, 'recipe_id'),
+    'subscriptions': (Subscribe, 'author_id'),
+}
+MEMBERSHIP_KINDS = {
+    model: (kind, field)
+    for kind, (model, field) in MEMBERSHIP_MODELS.items()
+}
+
+
+def membership_key(kind, user_id):
+    return f'membership:{kind}:{user_id}'
+
+
+def get_member_ids(kind, user_id):
+    '''Множество id рецептов (или авторов) пользователя.
+
+    В кэше хранится пара (версия, множество); запись с устаревшей
+    версией перестраивается одним запросом.
+    '''
+    version = get_version('membership', kind, user_id)
+    entry = cache.get(membership_key(kind, user_id))
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    model, field = MEMBERSHIP_MODELS[kind]
+    ids = frozenset(
+        model.objects.filter(user_id=user_id).values_list(field, flat=True)
+    )
+    cache.set(membership_key(kind, user_id), (version, ids),
+              settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return ids
+
+
+def invalidate_member_ids(kind, user_id):
+    '''Сбрасывает множество после изменения списка.
+
+    Запись не правится на месте: get-изменение-set двух параллельных
+    запросов теряет одно из изменений. Новая версия отбрасывает и
+    запись, которую в это время строит читатель по старым данным.
+    '''
+    bump_version('membership', kind, user_id)
+    cache.delete(membership_key(kind, user_id))
+
+
+class Membership:
+    '''Избранное, корзина и подписки пользователя в рамках запроса.'''
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._ids = {}
+
+    def get(self, kind):
+        if kind not in self._ids:
+            self._ids[kind] = get_member_ids(kind, self.user_id)
+        return self._ids[kind]
+
+    @property
+    def favorites(self):
+        return self.get('favorites')
+
+    @property
+    def cart(self):
+        return self.get('cart')
+
+    @property
+    def subscriptions(self):
+        return self.get('subscriptions')
+
+
+def get_membership(request):
+    '''Membership текущего пользователя или None для анонима.'''
+    if request is None or not request.user.is_authenticated:
+        return None
+    if not hasattr(request, '_membership'):
+        request._membership = Membership(request.user.id)
+    return request._membership
@@ -0,0 +1,280 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+METRICS = {
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Request latency', DURATION_BUCKETS),
+    'foodgram_request_db_queries': (
+        'histogram', 'SQL queries per request', QUERIES_BUCKETS),
+    'foodgram_request_db_seconds_total': (
+        'counter', 'Time spent in SQL queries', None),
+    'foodgram_response_bytes_total': (
+        'counter', 'Response body size', None),
+    'foodgram_requests_total': ('counter', 'Requests by status', None),
+}
+
+
+def get_view_name(request):
+    '''Имя вьюхи и действия: RecipeViewSet.list,
+    CustomUserViewSet.subscriptions.'''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view = getattr(match.func, 'cls', None) or match.func
+    name = getattr(view, '__name__', match.view_name)
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower())
+        if action:
+            return f'{name}.{action}'
+    return name
+
+
+class QueryTimer:
+    '''Обертка connection.execute_wrapper: число запросов и время в БД.'''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class Registry:
+    '''Метрики процесса. Каждый воркер gunicorn периодически пишет свои
+    накопленные значения в отдельный файл METRICS_DIR, эндпоинт
+    складывает файлы всех воркеров.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.values = {}
+        self.flushed = 0
+
+    def reset(self):
+        # После fork воркер начинает со своих нулей и своего файла.
+        self.pid = os.getpid()
+        self.path = os.path.join(
+            settings.METRICS_DIR,
+            f'metrics-{self.pid}-{uuid.uuid4().hex}.json')
+        self.values = {}
+        self.flushed = time.monotonic()
+
+    def observe(self, name, labels, value):
+        kind, _, buckets = METRICS[name]
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            key = (name, labels)
+            if kind == 'counter':
+                self.values[key] = self.values.get(key, 0) + value
+                return
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {
+                    'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                entry['buckets'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def record(self, view, method, status, duration, timer, size):
+        labels = (view, method)
+        self.observe('foodgram_request_duration_seconds', labels, duration)
+        self.observe('foodgram_request_db_queries', labels, timer.count)
+        self.observe('foodgram_request_db_seconds_total', labels,
+                     timer.duration)
+        self.observe('foodgram_response_bytes_total', labels, size)
+        self.observe('foodgram_requests_total',
+                     (view, method, str(status)), 1)
+        if (time.monotonic() - self.flushed
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            data = [[name, list(labels), value]
+                    for (name, labels), value in self.values.items()]
+            self.flushed = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temp = f'{self.path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(temp, self.path)
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def merge(total, name, labels, value):
+    key = (name, tuple(labels))
+    if METRICS[name][0] == 'counter':
+        total[key] = total.get(key, 0) + value
+        return
+    entry = total.setdefault(
+        key, {'buckets': [0] * len(value['buckets']), 'sum': 0, 'count': 0})
+    entry['buckets'] = [a + b for a, b in zip(entry['buckets'],
+                                              value['buckets'])]
+    entry['sum'] += value['sum']
+    entry['count'] += value['count']
+
+
+def get_pid(path):
+    return int(os.path.basename(path).split('-')[1])
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def mark_process_dead(pid, directory=None):
+    '''Удаляет файлы завершенного воркера. Вызывается из хука
+    gunicorn child_exit, см. gunicorn.conf.py.'''
+    directory = directory or settings.METRICS_DIR
+    for path in glob.glob(os.path.join(directory, f'metrics-{pid}-*.json')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def clear(directory=None):
+    '''Удаляет файлы всех воркеров, вызывается при старте gunicorn.'''
+    directory = directory or settings.METRICS_DIR
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect():
+    '''Сумма метрик живых воркеров. Файлы завершенных процессов
+    удаляются, Prometheus видит это как сброс счетчиков.'''
+    registry.flush()
+    total = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR,
+                                       'metrics-*.json')):
+        if not is_alive(get_pid(path)):
+            mark_process_dead(get_pid(path))
+            continue
+        try:
+            with open(path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data:
+            if name in METRICS:
+                merge(total, name, labels, value)
+    return total
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(names, values, bound=None):
+    labels = [f'{name}="{escape(value)}"'
+              for name, value in zip(names, values)]
+    if bound is not None:
+        labels.append(f'le="{bound}"')
+    return '{' + ','.join(labels) + '}'
+
+
+def render(total):
+    '''Текстовый формат Prometheus 0.0.4.'''
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        names = (('view', 'method', 'status')
+                 if name == 'foodgram_requests_total' else ('view', 'method'))
+        for (metric, labels), value in sorted(total.items()):
+            if metric != name:
+                continue
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{format_labels(names, labels, bound)} '
+                             f'{cumulative}')
+            lines += [
+                f'{name}_bucket{format_labels(names, labels, "+Inf")} '
+                f'{value["count"]}',
+                f'{name}_sum{format_labels(names, labels)} {value["sum"]}',
+                f'{name}_count{format_labels(names, labels)} '
+                f'{value["count"]}',
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    '''Время ответа, число и время SQL-запросов и размер ответа
+    по каждой вьюхе. При METRICS_ENABLED=False не подключается вовсе.'''
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        view = get_view_name(request)
+        if response.streaming and not response.has_header('Content-Length'):
+            # Тело генерируется после выхода из middleware: запросы
+            # и размер считаются по мере отдачи.
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, view,
+                started, timer)
+            return response
+        size = (int(response['Content-Length']) if response.streaming
+                else len(response.content))
+        registry.record(view, request.method, response.status_code,
+                        time.perf_counter() - started, timer, size)
+        return response
+
+    def stream(self, content, request, response, view, started, timer):
+        size = 0
+        connection.execute_wrappers.append(timer)
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            connection.execute_wrappers.remove(timer)
+            registry.record(view, request.method, response.status_code,
+                            time.perf_counter() - started, timer, size)
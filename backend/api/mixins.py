@@ -1,3 +1,6 @@
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
 from rest_framework import mixins, viewsets
 
 
@@ -5,3 +8,43 @@ class CreateDestroyViewSet(mixins.CreateModelMixin,
                            mixins.DestroyModelMixin,
                            viewsets.GenericViewSet):
     pass
+
+
+class ConditionalGetMixin:
+    '''Условные GET для list и retrieve.
+
+    Вьюсет возвращает пару (etag, last_modified) из get_list_validators
+    и get_detail_validators; при совпадении с If-None-Match или
+    If-Modified-Since ответ 304 отдается до сериализации.
+    '''
+
+    def get_list_validators(self):
+        return None
+
+    def get_detail_validators(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_validators(), super().list,
+            request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_detail_validators(), super().retrieve,
+            request, *args, **kwargs)
+
+    def conditional_response(self, validators, handler,
+                             request, *args, **kwargs):
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -1,6 +1,90 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CachedCountPaginator(Paginator):
+    '''Пагинатор, который берет общее количество из кэша, а для
+    больших таблиц без фильтров - из статистики планировщика PostgreSQL.'''
+
+    def __init__(self, *args, count_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return self.get_count()
+        count = cache.get(self.count_key)
+        if count is None:
+            count = self.get_count()
+            cache.set(self.count_key, count,
+                      settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
+
+    def get_count(self):
+        queryset = self.object_list
+        estimate = self.estimate_count(queryset)
+        if estimate is not None:
+            return estimate
+        # values('pk') отбрасывает аннотации, и COUNT не вычисляет
+        # подзапросы персональных флагов для каждой строки.
+        return queryset.values('pk').count()
+
+    def estimate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+            return row[0]
+        return None
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class CachedCountPagination(LimitPageNumberPagination):
+    '''Постраничная пагинация с кэшируемым count.
+
+    Ключ кэша строит вьюсет в get_count_cache_key(); если метода нет
+    или он вернул None, количество считается точно.'''
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            count_key=self.get_count_key(view)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_key(self, view):
+        get_count_cache_key = getattr(view, 'get_count_cache_key', None)
+        if get_count_cache_key is None:
+            return None
+        parts = get_count_cache_key()
+        if parts is None:
+            return None
+        digest = hashlib.md5(repr(parts).encode()).hexdigest()
+        return f'count:{digest}'
+
+
+class RecipeCursorPagination(CursorPagination):
+    '''Курсорная пагинация ленты рецептов: без COUNT(*) и OFFSET,
+    позиция кодируется в непрозрачном курсоре по (pub_date, id).'''
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
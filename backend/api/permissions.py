@@ -1,3 +1,6 @@
+import hmac
+
+from django.conf import settings
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
 
@@ -16,3 +19,16 @@ class IsAuthorOrReadOnly(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return obj.author == request.user
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    '''Метрики: администратор или заголовок
+    Authorization: Bearer <METRICS_TOKEN> для Prometheus.'''
+
+    def has_permission(self, request, view):
+        if request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return bool(token) and hmac.compare_digest(
+            header.encode(), f'Bearer {token}'.encode())
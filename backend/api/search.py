@@ -0,0 +1,232 @@
+import bisect
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+from recipes.models import Ingredient, Recipe
+
+from .cache import get_version
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def trigrams(text):
+    '''Множество триграмм строки по правилам pg_trgm: слова в нижнем
+    регистре дополняются двумя пробелами слева и одним справа.'''
+    result = set()
+    for word in WORD_RE.findall(text.lower()):
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class IngredientIndex:
+    '''Неизменяемый индекс ингредиентов для автодополнения.
+
+    Названия хранятся в отсортированном массиве в casefold-виде:
+    совпадения по префиксу находятся бинарным поиском, совпадения
+    по подстроке - проходом по массиву и идут после префиксных.
+    '''
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.keys = sorted(
+            (row['name'].casefold(), position)
+            for position, row in enumerate(rows)
+        )
+        self._trigrams = None
+
+    def search(self, query, limit):
+        query = query.casefold().strip()
+        if not query:
+            return self.rows[:limit]
+        found = []
+        start = bisect.bisect_left(self.keys, (query,))
+        for name, position in self.keys[start:start + limit]:
+            if not name.startswith(query):
+                break
+            found.append(position)
+        if len(found) < limit:
+            found.extend(
+                position for name, position in self.keys
+                if query in name and not name.startswith(query)
+            )
+        return [self.rows[position] for position in found[:limit]]
+
+    def build_trigrams(self):
+        postings = {}
+        sizes = []
+        for position, row in enumerate(self.rows):
+            row_trigrams = trigrams(row['name'])
+            sizes.append(len(row_trigrams))
+            for trigram in row_trigrams:
+                postings.setdefault(trigram, []).append(position)
+        return postings, sizes
+
+    def fuzzy_search(self, query, limit, threshold):
+        '''Поиск с опечатками: similarity() из pg_trgm по инвертированному
+        индексу триграмм, по убыванию сходства.'''
+        if self._trigrams is None:
+            self._trigrams = self.build_trigrams()
+        postings, sizes = self._trigrams
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(postings.get(trigram, ()))
+        scored = []
+        for position, common in shared.items():
+            similarity = common / (
+                len(query_trigrams) + sizes[position] - common)
+            if similarity >= threshold:
+                scored.append((-similarity, self.rows[position]['name'],
+                               position))
+        scored.sort()
+        return [self.rows[position] for *_, position in scored[:limit]]
+
+
+_ingredient_index = None
+_ingredient_index_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    '''Индекс текущей версии каталога; строится при первом обращении
+    и после любого изменения ингредиентов.'''
+    global _ingredient_index
+    version = get_version('catalog', 'ingredients')
+    index = _ingredient_index
+    if index is not None and index.version == version:
+        return index
+    with _ingredient_index_lock:
+        index = _ingredient_index
+        if index is None or index.version != version:
+            from .serializers import IngredientSerializer
+            rows = IngredientSerializer(
+                Ingredient.objects.all(), many=True).data
+            index = IngredientIndex(version, [dict(row) for row in rows])
+            _ingredient_index = index
+    return index
+
+
+def fuzzy_search_ingredients(query):
+    '''На PostgreSQL ищет через GIN-индекс pg_trgm, на других базах -
+    по триграммному индексу в памяти с теми же правилами подсчета.'''
+    limit = settings.INGREDIENT_SEARCH_LIMIT
+    threshold = settings.INGREDIENT_TRIGRAM_THRESHOLD
+    if connection.vendor != 'postgresql':
+        return get_ingredient_index().fuzzy_search(query, limit, threshold)
+    from .serializers import IngredientSerializer
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT set_limit(%s)', [threshold])
+    queryset = Ingredient.objects.filter(
+        name__trigram_similar=query
+    ).annotate(
+        similarity=TrigramSimilarity('name', query)
+    ).order_by('-similarity', 'name')[:limit]
+    return IngredientSerializer(queryset, many=True).data
+
+
+def search_ingredients(query, fuzzy=False):
+    '''Префиксный поиск; если он ничего не нашел или запрошен
+    ?fuzzy=1, выполняется поиск с опечатками.'''
+    index = get_ingredient_index()
+    if not query:
+        return index.rows
+    if not fuzzy:
+        found = index.search(query, settings.INGREDIENT_SEARCH_LIMIT)
+        if found:
+            return found
+    return fuzzy_search_ingredients(query)
+
+
+class RecipeIndex:
+    '''Инвертированный индекс рецептов для баз без полнотекстового
+    поиска: слово из запроса совпадает с началом слова рецепта,
+    совпадение в названии весит больше, чем в описании.'''
+    NAME_WEIGHT = 1.0
+    TEXT_WEIGHT = 0.4
+
+    def __init__(self, version, recipes):
+        self.version = version
+        self.postings = {}
+        for recipe_id, name, text in recipes:
+            for weight, value in ((self.NAME_WEIGHT, name),
+                                  (self.TEXT_WEIGHT, text)):
+                for word in WORD_RE.findall(value.lower()):
+                    scores = self.postings.setdefault(word, {})
+                    scores[recipe_id] = scores.get(recipe_id, 0) + weight
+        self.words = sorted(self.postings)
+
+    def match(self, term):
+        scores = Counter()
+        start = bisect.bisect_left(self.words, term)
+        for word in self.words[start:]:
+            if not word.startswith(term):
+                break
+            scores.update(self.postings[word])
+        return scores
+
+    def search(self, query):
+        '''id рецептов, содержащих все слова запроса, по убыванию веса.'''
+        terms = WORD_RE.findall(query.lower())
+        if not terms:
+            return []
+        ranked = None
+        for term in terms:
+            scores = self.match(term)
+            if ranked is None:
+                ranked = scores
+            else:
+                ranked = Counter({
+                    recipe_id: ranked[recipe_id] + score
+                    for recipe_id, score in scores.items()
+                    if recipe_id in ranked
+                })
+        return [recipe_id for recipe_id, _ in ranked.most_common()]
+
+
+_recipe_index = None
+_recipe_index_lock = threading.Lock()
+
+
+def get_recipe_index():
+    global _recipe_index
+    version = get_version('search', 'recipes')
+    index = _recipe_index
+    if index is not None and index.version == version:
+        return index
+    with _recipe_index_lock:
+        index = _recipe_index
+        if index is None or index.version != version:
+            index = RecipeIndex(
+                version, Recipe.objects.values_list('id', 'name', 'text'))
+            _recipe_index = index
+    return index
+
+
+def search_recipes(queryset, query):
+    '''Фильтрует рецепты по словам запроса и сортирует по релевантности.
+
+    На PostgreSQL используется хранимый tsvector с GIN-индексом,
+    на остальных базах - индекс в памяти процесса.
+    '''
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-pub_date', '-id')
+    ids = get_recipe_index().search(query)
+    return queryset.filter(id__in=ids).order_by(
+        Case(*(When(id=recipe_id, then=Value(position))
+               for position, recipe_id in enumerate(ids)),
+             output_field=IntegerField()),
+        '-pub_date'
+    )
@@ -1,17 +1,25 @@
-import base64
-import uuid
+import json
 
-from django.core.files.base import ContentFile
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import QueryDict
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
-                            Recipe, ShoppingCart, Tag)
+from recipes.images import enqueue_recipe_image
+from recipes.models import (Ingredient, IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from user.models import Subscribe, User
 
+from .fragments import get_fragment_keys, get_fragments, set_fragments
+from .membership import get_membership
+from .uploads import decode_base64_image
+
+# Рецептов автора в подписках, если не передан ?recipes_limit.
+RECIPES_LIMIT = 3
+
 
 class GetUserSerializer(UserSerializer):
     ''''Запрос списка подписок'''
@@ -24,10 +32,10 @@ class GetUserSerializer(UserSerializer):
             'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
             return False
-        return Subscribe.objects.filter(user=user, author=obj.id).exists()
+        return obj.id in membership.subscriptions
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -61,11 +69,47 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class ImageVariantsField(serializers.Field):
+    '''Ссылки на варианты картинки рецепта. Пока фоновая обработка
+    не закончена, вместо вариантов отдается оригинал.'''
+    VARIANTS = (
+        ('thumbnail', 'image_thumbnail'),
+        ('detail', 'image_detail'),
+        ('original', 'image'),
+    )
+
+    def __init__(self, absolute=True, **kwargs):
+        self.absolute = absolute
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        images = {}
+        for name, field in self.VARIANTS:
+            url = (getattr(recipe, field) or recipe.image).url
+            if self.absolute and request is not None:
+                url = request.build_absolute_uri(url)
+            images[name] = url
+        return images
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    '''Рендерит страницу рецептов одним обращением к кэшу фрагментов'''
+
+    def to_representation(self, data):
+        return self.child.to_representation_many(list(data))
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     '''Сериализатор для чтения Рецепта'''
     tags = TagSerializer(many=True, read_only=True)
     author = GetUserSerializer(read_only=True)
     image = Base64ImageField()
+    images = ImageVariantsField()
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
@@ -74,43 +118,128 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'tags', 'ingredients', 'text',
                   'is_favorited', 'is_in_shopping_cart', 'author', 'image',
-                  'cooking_time', 'name', 'pub_date')
+                  'images', 'cooking_time', 'name', 'pub_date',
+                  'favorites_count', 'in_carts_count')
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, instances):
+        '''Общая для всех часть берется из кэша, недостающие фрагменты
+        собираются пачкой, персональные флаги накладываются сверху.'''
+        request = self.context.get('request')
+        keys = get_fragment_keys(instances, request)
+        fragments = get_fragments(keys.values())
+        missing = [recipe for recipe in instances
+                   if keys[recipe.id] not in fragments]
+        if missing:
+            built = self.build_fragments(missing)
+            fragments.update(
+                (keys[recipe.id], built[recipe.id]) for recipe in missing
+            )
+            set_fragments({keys[recipe.id]: built[recipe.id]
+                           for recipe in missing})
+        return [
+            self.add_personal_fields(
+                self.add_counters(fragments[keys[recipe.id]], recipe),
+                recipe)
+            for recipe in instances
+        ]
+
+    def build_fragments(self, recipes):
+        prefetch_related_objects(
+            recipes,
+            'tags',
+            Prefetch(
+                'recipe',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient')
+            )
+        )
+        fragments = {}
+        for recipe in recipes:
+            fragment = super().to_representation(recipe)
+            fragment['is_favorited'] = False
+            fragment['is_in_shopping_cart'] = False
+            fragment['author']['is_subscribed'] = False
+            fragments[recipe.id] = fragment
+        return fragments
+
+    def add_counters(self, fragment, recipe):
+        # Счетчики меняются без новой версии рецепта и берутся из объекта.
+        fragment['favorites_count'] = recipe.favorites_count
+        fragment['in_carts_count'] = recipe.in_carts_count
+        return fragment
+
+    def add_personal_fields(self, fragment, recipe):
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
+            return fragment
+        fragment['is_favorited'] = recipe.id in membership.favorites
+        fragment['is_in_shopping_cart'] = recipe.id in membership.cart
+        fragment['author'] = dict(
+            fragment['author'],
+            is_subscribed=recipe.author_id in membership.subscriptions
+        )
+        return fragment
 
     def get_ingredients(self, obj):
-        queryset = IngredientAmount.objects.filter(recipe=obj)
+        queryset = obj.recipe.all()
         return IngredientAmountSerializer(queryset, many=True).data
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return (FavoriteRecipe.objects.filter(user=user,
-                    recipe_id=obj.id).exists())
-        return False
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
+            return False
+        return obj.id in membership.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return (ShoppingCart.objects.filter(user=user,
-                    recipe_id=obj.id).exists())
-        return False
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
+            return False
+        return obj.id in membership.cart
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    '''Список id рецептов для пакетного добавления и удаления'''
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    '''Замена картинки рецепта загрузкой файла'''
+    image = serializers.ImageField()
+
+    class Meta:
+        model = Recipe
+        fields = ('image',)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        enqueue_recipe_image(instance)
+        return instance
 
 
 class CropRecipeSerializer(serializers.ModelSerializer):
     '''Сериализатор для просмотра рецепта на главной'''
     image = serializers.CharField(source="image.url")
+    images = ImageVariantsField(absolute=False)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class Base64ImageField(serializers.ImageField):
+    '''Принимает картинку строкой base64 или файлом из multipart.'''
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr),
-                               name=f'{uuid.uuid1()}.{ext}')
+            data = decode_base64_image(data, self.context.get('request'))
 
         return super().to_internal_value(data)
 
@@ -139,6 +268,29 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         fields = ('ingredients', 'tags', 'image', 'name',
                   'text', 'cooking_time', 'id', 'author')
 
+    def to_internal_value(self, data):
+        if isinstance(data, QueryDict):
+            data = self.parse_form_data(data)
+        return super().to_internal_value(data)
+
+    def parse_form_data(self, data):
+        '''В multipart/form-data ингредиенты передаются JSON-строкой,
+        теги - JSON-строкой или повторяющимся полем tags.'''
+        values = data.dict()
+        tags = data.getlist('tags')
+        if len(tags) == 1 and tags[0].startswith('['):
+            tags = tags[0]
+        for field, value in (('tags', tags),
+                             ('ingredients', values.get('ingredients'))):
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    raise ValidationError({field: 'Ожидается JSON-список.'})
+            if value is not None:
+                values[field] = value
+        return values
+
     def validate(self, obj):
         for field in ['name', 'text', 'cooking_time']:
             if not obj.get(field):
@@ -165,6 +317,13 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         if len(array_ing) != len(set(array_ing)):
             raise serializers.ValidationError(
                 'Ингредиенты не должны повторяться')
+        missing = set(array_ing) - set(
+            Ingredient.objects.in_bulk(array_ing))
+        if missing:
+            raise ValidationError({
+                'ingredients': 'Ингредиенты не найдены: '
+                               f'{", ".join(map(str, sorted(missing)))}'
+            })
         for tag in tags:
             if tag in array_tag:
                 raise ValidationError({
@@ -173,17 +332,49 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             array_tag.append(tag)
         return obj
 
-    
     def create_ingredients_amounts(self, ingredients, recipe):
         IngredientAmount.objects.bulk_create(
             [IngredientAmount(
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 recipe=recipe,
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
 
-    
+    def update_ingredients_amounts(self, ingredients, recipe):
+        '''Применяет к составу рецепта только реальные изменения.
+
+        Возвращает id ингредиентов, которые были добавлены, удалены
+        или поменяли количество.
+        '''
+        existing = {item.ingredient_id: item for item in recipe.recipe.all()}
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        to_delete = [item.id for ingredient_id, item in existing.items()
+                     if ingredient_id not in amounts]
+        to_update = []
+        for ingredient_id, amount in amounts.items():
+            item = existing.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                to_update.append(item)
+        to_create = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in existing
+        ]
+        if to_delete:
+            IngredientAmount.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientAmount.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            self.create_ingredients_amounts(to_create, recipe)
+        return (set(existing) ^ set(amounts)) | {
+            item.ingredient_id for item in to_update
+        }
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -191,19 +382,25 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         self.create_ingredients_amounts(recipe=recipe,
                                         ingredients=ingredients)
+        enqueue_recipe_image(recipe)
         return recipe
 
-    
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
+        if 'image' in validated_data:
+            enqueue_recipe_image(instance)
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients_amounts(recipe=instance,
-                                        ingredients=ingredients)
-        instance.save()
+        changed = self.update_ingredients_amounts(recipe=instance,
+                                                  ingredients=ingredients)
+        if changed:
+            ShoppingListItem.objects.refresh(
+                ShoppingCart.objects.filter(
+                    recipe=instance).values_list('user_id', flat=True),
+                ingredient_ids=changed
+            )
         return instance
 
     def to_representation(self, instance):
@@ -213,6 +410,19 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                                     context=context).data
 
 
+def get_recipes_limit(request):
+    try:
+        return max(int(request.query_params['recipes_limit']), 0)
+    except (AttributeError, KeyError, ValueError):
+        return RECIPES_LIMIT
+
+
+def get_recipes_by_author(author_ids, limit):
+    return Recipe.objects.latest_by_authors(
+        author_ids, limit, fields=('name', 'image', 'image_thumbnail',
+                                   'image_detail', 'cooking_time'))
+
+
 class SubscribeListSerializer(GetUserSerializer):
     '''Сериализатор для подписок'''
     recipes = serializers.SerializerMethodField()
@@ -226,6 +436,9 @@ class SubscribeListSerializer(GetUserSerializer):
                             'first_name', 'last_name')
 
     def get_recipes_count(self, obj):
+        # Во вьюсете количество уже посчитано аннотацией.
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
     def validate(self, attrs):
@@ -244,11 +457,12 @@ class SubscribeListSerializer(GetUserSerializer):
         return attrs
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        try:
-            recipes = recipes[:int(limit)]
-        except:
-            recipes = obj.recipes.all()[:3]
-        serializer = CropRecipeSerializer(recipes, many=True, read_only=True)
+        '''Рецепты всей страницы авторов выбираются во вьюсете одним
+        запросом и передаются в контексте recipes_by_author.'''
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is None:
+            recipes_by_author = get_recipes_by_author(
+                [obj.id], get_recipes_limit(self.context.get('request')))
+        serializer = CropRecipeSerializer(
+            recipes_by_author.get(obj.id, []), many=True, read_only=True)
         return serializer.data
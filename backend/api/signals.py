@@ -0,0 +1,120 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            counters_changed)
+from user.models import Subscribe, User
+
+from .cache import bump_version_on_commit, bump_versions_on_commit
+from .membership import MEMBERSHIP_KINDS, invalidate_member_ids
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    # Версия меняется после коммита, то есть уже после записи тегов и
+    # ингредиентов в RecipeWriteSerializer.create/update или в админке.
+    # recipes - версия всех списков: ETag, Last-Modified и кэш количества.
+    bump_version_on_commit('recipes')
+    bump_version_on_commit('recipe', instance.id)
+    bump_version_on_commit('search', 'recipes')
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    bump_version_on_commit('recipes')
+    bump_version_on_commit('recipe', instance.recipe_id)
+
+
+@receiver(counters_changed)
+def recipe_counters_changed(sender, recipe_ids, **kwargs):
+    # Счетчики меняются без updated_at, поэтому у них свои метки
+    # версий для ETag и Last-Modified списка и рецепта.
+    bump_versions_on_commit(
+        [('counters',)] + [('counters', pk) for pk in recipe_ids])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, action, **kwargs):
+    # Количество рецептов с фильтром по тегам кэшируется под версией
+    # recipes, смена тегов рецепта должна ее сбросить.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version_on_commit('recipes')
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    instance._cart_user_ids = list(
+        instance.purchase.values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    # Корзины с рецептом уже удалены каскадом, суммы пересчитываются
+    # в той же транзакции.
+    ShoppingListItem.objects.refresh(
+        getattr(instance, '_cart_user_ids', ()))
+    bump_version_on_commit('recipes')
+    bump_version_on_commit('recipe', instance.id)
+    bump_version_on_commit('search', 'recipes')
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def cart_changed(sender, instance, created=True, origin=None, **kwargs):
+    # Корзина меняется и мимо API: админка, shell, фикстуры. Пакетные
+    # add/remove менеджера сигналов не отправляют и пересчитывают сами.
+    # Каскад от рецепта пересчитывается пачкой в recipe_deleted,
+    # а список удаляемого пользователя удаляется вместе с ним.
+    if not created or getattr(origin, 'model', type(origin)) in (Recipe,
+                                                                 User):
+        return
+    ShoppingListItem.objects.refresh(
+        [instance.user_id], recipe_ids=[instance.recipe_id])
+
+
+@receiver(post_save, sender=User)
+def profile_saved(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login и не меняет профиль.
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    bump_version_on_commit('profile', instance.id)
+    bump_version_on_commit('profiles')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    bump_version_on_commit('catalog', 'tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    bump_version_on_commit('catalog', 'ingredients')
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscribe)
+def user_list_changed(sender, instance, **kwargs):
+    bump_version_on_commit('user', instance.user_id)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscribe)
+def membership_changed(sender, instance, created=True, **kwargs):
+    if not created:
+        return
+    kind, _ = MEMBERSHIP_KINDS[sender]
+    transaction.on_commit(
+        lambda: invalidate_member_ids(kind, instance.user_id))
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test.utils import override_settings
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+from user.models import User
+
+# Картинка 1x2 PNG для загрузки через API.
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABiey'
+         'waAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklE'
+         'QVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg==')
+
+
+class APITestBase(APITestCase):
+    '''Кэш в памяти, файлы во временном каталоге, фоновые задачи
+    выключены: картинки остаются в очереди, лента рассылается сразу
+    после коммита.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=cls.media,
+            SHOPPING_LIST_CACHE_DIR=os.path.join(cls.media, 'shopping_lists'),
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tests',
+            }},
+            RECIPE_IMAGE_PROCESSING='queue',
+            FEED_FANOUT_PROCESSING='sync',
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (('Завтрак', Tag.ORANGE, 'breakfast'),
+                                      ('Обед', Tag.GREEN, 'lunch'))
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'),
+                               ('яйцо', 'шт'))
+        ]
+        cls.user = cls.create_user('reader')
+        cls.authors = [cls.create_user(f'author{number}')
+                       for number in range(7)]
+        cls.recipes = [cls.create_recipe(author, number)
+                       for number, author in enumerate(cls.authors)]
+
+    @classmethod
+    def create_user(cls, username):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com',
+            first_name='Иван', last_name=username, password='pass12345!')
+
+    @classmethod
+    def create_recipe(cls, author, number=0):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Блины {number}', text='Смешать и жарить',
+            cooking_time=10, image='recipe/test.png')
+        recipe.tags.set(cls.tags)
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(recipe=recipe, ingredient=ingredient,
+                             amount=10 * (position + 1))
+            for position, ingredient in enumerate(cls.ingredients)
+        ])
+        return recipe
+
+    def setUp(self):
+        # Метки версий живут в кэше и не откатываются вместе с базой.
+        cache.clear()
+        self.client = self.get_client(self.user)
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def get_payload(self, **fields):
+        return {
+            'ingredients': [{'id': ingredient.id, 'amount': 5}
+                            for ingredient in self.ingredients],
+            'tags': [tag.id for tag in self.tags],
+            'image': IMAGE,
+            'name': 'Оладьи',
+            'text': 'Смешать и жарить',
+            'cooking_time': 15,
+            **fields,
+        }
@@ -0,0 +1,74 @@
+from .base import APITestBase
+
+
+class ConditionalGetTest(APITestBase):
+    '''ETag списка и рецепта: 304 до изменения и новый ETag после.'''
+
+    def assertNotModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def change(self, method, url, data=None, client=None):
+        # Метки версий меняются в transaction.on_commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(client or self.client, method)(
+                url, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotModified('/api/recipes/', response['ETag'])
+
+    def test_list_invalidated_by_recipe_changes(self):
+        recipe = self.recipes[0]
+        author = self.get_client(recipe.author)
+        etag = self.client.get('/api/recipes/')['ETag']
+        self.change('patch', f'/api/recipes/{recipe.id}/',
+                    self.get_payload(name='Новое название'), author)
+        etag = self.assertModified('/api/recipes/', etag)
+        self.change('delete', f'/api/recipes/{recipe.id}/', client=author)
+        self.assertModified('/api/recipes/', etag)
+
+    def test_list_invalidated_by_personal_lists(self):
+        recipe = self.recipes[0]
+        etag = self.client.get('/api/recipes/')['ETag']
+        self.change('post', f'/api/recipes/{recipe.id}/favorite/')
+        etag = self.assertModified('/api/recipes/', etag)
+        self.change('post', '/api/recipes/shopping_cart/',
+                    {'ids': [recipe.id]})
+        self.assertModified('/api/recipes/', etag)
+
+    def test_list_etag_is_per_user(self):
+        etag = self.client.get('/api/recipes/')['ETag']
+        response = self.get_client().get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_invalidated(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+        # Счетчик меняется у рецепта, которого нет в списках читателя.
+        self.change('post', f'/api/recipes/{recipe.id}/favorite/',
+                    client=self.get_client(self.authors[1]))
+        etag = self.assertModified(url, etag)
+        self.change('patch', '/api/users/me/', {'first_name': 'Петр'},
+                    self.get_client(recipe.author))
+        self.assertModified(url, etag)
+
+    def test_detail_not_found(self):
+        self.assertEqual(self.client.get('/api/recipes/abc/').status_code,
+                         404)
+        self.assertEqual(self.client.get('/api/recipes/0/').status_code,
+                         404)
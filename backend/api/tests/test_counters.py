@@ -0,0 +1,61 @@
+import io
+from contextlib import redirect_stdout
+
+from django.core.management import call_command
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+
+from .base import APITestBase
+
+
+class CountersTest(APITestBase):
+    '''Счетчики избранного и корзины и их сверка.'''
+
+    def get_counters(self, recipe):
+        recipe.refresh_from_db()
+        return recipe.favorites_count, recipe.in_carts_count
+
+    def test_orm_writes(self):
+        recipe = self.recipes[0]
+        favorite = FavoriteRecipe.objects.create(user=self.user,
+                                                 recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.assertEqual(self.get_counters(recipe), (1, 1))
+        favorite.delete()
+        self.assertEqual(self.get_counters(recipe), (0, 1))
+
+    def test_never_negative(self):
+        recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        Recipe.objects.filter(id=recipe.id).update(favorites_count=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(self.get_counters(recipe), (0, 0))
+
+    def test_reconcile(self):
+        first, second = self.recipes[:2]
+        FavoriteRecipe.objects.create(user=self.user, recipe=first)
+        ShoppingCart.objects.create(user=self.user, recipe=second)
+        Recipe.objects.filter(id=first.id).update(favorites_count=5)
+        Recipe.objects.filter(id=second.id).update(in_carts_count=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Recipe.objects.reconcile_counters(), 2)
+        self.assertEqual(self.get_counters(first), (1, 0))
+        self.assertEqual(self.get_counters(second), (0, 1))
+        self.assertEqual(Recipe.objects.reconcile_counters(), 0)
+
+    def test_reconcile_invalidates_etag(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        list_etag = self.client.get('/api/recipes/')['ETag']
+        etag = self.client.get(url)['ETag']
+        Recipe.objects.filter(id=recipe.id).update(favorites_count=3)
+        with self.captureOnCommitCallbacks(execute=True), \
+                redirect_stdout(io.StringIO()):
+            call_command('reconcile_counters')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['favorites_count'], 0)
+        response = self.client.get('/api/recipes/',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+from recipes.models import ShoppingCart
+
+from .base import APITestBase
+
+
+class ShoppingListExportTest(APITestBase):
+    '''Выгрузка списка покупок во всех форматах.'''
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for recipe in cls.recipes[:2]:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def download(self, extension):
+        response = self.client.get(f'{self.url}?format={extension}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'shopping_list.{extension}',
+                      response['Content-Disposition'])
+        return response, b''.join(response.streaming_content)
+
+    def test_txt(self):
+        response, content = self.download('txt')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = content.decode()
+        for line in ('мука 20 г', 'молоко 40 мл', 'яйцо 60 шт'):
+            self.assertIn(line, text)
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows, [
+            ['name', 'amount', 'measurement_unit'],
+            ['молоко', '40', 'мл'], ['мука', '20', 'г'], ['яйцо', '60', 'шт'],
+        ])
+
+    def test_json(self):
+        response, content = self.download('json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(content)
+        self.assertEqual(data['user'], self.user.username)
+        self.assertEqual(
+            {item['name']: item['amount'] for item in data['ingredients']},
+            {'мука': 20, 'молоко': 40, 'яйцо': 60})
+
+    def test_pdf_cached_per_user(self):
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        directory = os.path.join(settings.SHOPPING_LIST_CACHE_DIR,
+                                 str(self.user.id))
+        files = os.listdir(directory)
+        self.assertEqual(len(files), 1)
+        self.download('pdf')
+        self.assertEqual(os.listdir(directory), files)
+        # Новый состав корзины заменяет файл пользователя.
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[2])
+        self.download('pdf')
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertNotEqual(os.listdir(directory), files)
+
+    def test_errors(self):
+        response = self.client.get(f'{self.url}?format=xml')
+        self.assertEqual(response.status_code, 400)
+        ShoppingCart.objects.filter(user=self.user).delete()
+        response = self.client.get(f'{self.url}?format=txt')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,53 @@
+from recipes.models import FeedEntry, Recipe
+from user.models import Subscribe
+
+from .base import APITestBase
+
+
+class FeedTest(APITestBase):
+    '''Лента подписок: рассылка при записи и подмешивание при чтении.'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.authors[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/users/{self.author.id}/subscribe/')
+
+    def create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get_client(self.author).post(
+                '/api/recipes/', self.get_payload(), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Recipe.objects.get(id=response.json()['id'])
+
+    def get_feed(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_backfill_on_subscribe(self):
+        self.assertEqual(self.get_feed(), [self.recipes[0].id])
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.get_feed(), [])
+
+    def test_fan_out(self):
+        recipe = self.create()
+        self.assertTrue(recipe.feed_fanout)
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.user, recipe=recipe).exists())
+        self.assertEqual(self.get_feed(), [recipe.id, self.recipes[0].id])
+
+    def test_pulled_until_fanned_out(self):
+        with self.settings(FEED_FANOUT_PROCESSING='queue'):
+            recipe = self.create()
+        self.assertFalse(recipe.feed_fanout)
+        self.assertEqual(self.get_feed(), [recipe.id, self.recipes[0].id])
+
+    def test_popular_author_is_pulled(self):
+        with self.settings(FEED_FANOUT_MAX_FOLLOWERS=0):
+            recipe = self.create()
+        self.assertFalse(recipe.feed_fanout)
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        self.assertEqual(self.get_feed(), [recipe.id, self.recipes[0].id])
+        Subscribe.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get_feed(), [])
@@ -0,0 +1,72 @@
+from django.core.files.storage import default_storage
+from recipes.models import ImageTask, MediaFile, Recipe
+
+from .base import APITestBase
+
+
+class ImagePipelineTest(APITestBase):
+    '''Обработка картинок и счетчики ссылок MediaFile.'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.get_client(self.authors[0])
+
+    def create(self, **fields):
+        with self.settings(RECIPE_IMAGE_PROCESSING='sync'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.author.post(
+                '/api/recipes/', self.get_payload(**fields), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Recipe.objects.get(id=response.json()['id'])
+
+    def delete(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author.delete(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 204)
+
+    def get_refs(self, recipe):
+        names = [recipe.image.name, recipe.image_thumbnail.name,
+                 recipe.image_detail.name]
+        refs = dict(MediaFile.objects.filter(
+            name__in=names).values_list('name', 'refs'))
+        return [refs.get(name, 0) for name in names]
+
+    def test_variants(self):
+        recipe = self.create()
+        task = ImageTask.objects.get(recipe=recipe)
+        self.assertEqual(task.status, ImageTask.DONE)
+        self.assertTrue(recipe.image_thumbnail.name.endswith('.webp'))
+        self.assertTrue(recipe.image_detail.name.endswith('.webp'))
+        for field in (recipe.image, recipe.image_thumbnail,
+                      recipe.image_detail):
+            self.assertTrue(default_storage.exists(field.name))
+        self.assertEqual(self.get_refs(recipe), [1, 1, 1])
+
+    def test_shared_files(self):
+        first = self.create()
+        second = self.create(name='Оладьи 2')
+        # Одинаковая картинка хранится одним файлом на оба рецепта.
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(self.get_refs(first), [2, 2, 2])
+        self.delete(first)
+        self.assertEqual(self.get_refs(second), [1, 1, 1])
+        self.assertTrue(default_storage.exists(second.image.name))
+        self.delete(second)
+        self.assertEqual(self.get_refs(second), [0, 0, 0])
+        for field in (second.image, second.image_thumbnail,
+                      second.image_detail):
+            self.assertFalse(default_storage.exists(field.name))
+        self.assertFalse(MediaFile.objects.filter(
+            name__startswith='recipe/', refs__gt=0).exclude(
+            name='recipe/test.png').exists())
+
+    def test_queued_until_processed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.author.post(
+                '/api/recipes/', self.get_payload(), format='json')
+        recipe = Recipe.objects.get(id=response.json()['id'])
+        task = ImageTask.objects.get(recipe=recipe)
+        self.assertEqual(task.status, ImageTask.PENDING)
+        self.assertFalse(recipe.image_thumbnail)
+        # Файл загрузки держит ровно одна ссылка рецепта.
+        self.assertEqual(self.get_refs(recipe)[0], 1)
@@ -0,0 +1,107 @@
+from recipes.models import (FavoriteRecipe, Recipe, ShoppingCart,
+                            ShoppingListItem)
+
+from .base import APITestBase
+
+
+class BulkListsTest(APITestBase):
+    '''Пакетное и одиночное добавление в избранное и корзину.'''
+
+    def post(self, url, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, {'ids': ids}, format='json')
+
+    def delete(self, url, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.delete(url, {'ids': ids}, format='json')
+
+    def get_statuses(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return {item['id']: item['status']
+                for item in response.json()['results']}
+
+    def test_bulk_statuses(self):
+        first, second = self.recipes[0].id, self.recipes[1].id
+        missing = Recipe.objects.order_by('-id').first().id + 1
+        for url, model in (('/api/recipes/favorite/', FavoriteRecipe),
+                           ('/api/recipes/shopping_cart/', ShoppingCart)):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.get_statuses(self.post(url, [first])),
+                    {first: 'added'})
+                response = self.post(url, [first, second, missing])
+                self.assertEqual(
+                    self.get_statuses(response),
+                    {first: 'already_added', second: 'added',
+                     missing: 'not_found'})
+                self.assertEqual(
+                    model.objects.filter(user=self.user).count(), 2)
+                self.assertEqual(
+                    self.get_statuses(self.delete(url, [first, missing])),
+                    {first: 'removed', missing: 'not_in_list'})
+                self.assertEqual(
+                    list(model.objects.filter(user=self.user).values_list(
+                        'recipe_id', flat=True)), [second])
+
+    def test_bulk_validation(self):
+        for data in ({}, {'ids': []}, {'ids': ['abc']}, {'ids': [0]}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    '/api/recipes/favorite/', data, format='json')
+                self.assertEqual(response.status_code, 400)
+        response = self.get_client().post(
+            '/api/recipes/favorite/', {'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_single_statuses(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(
+            self.client.post('/api/recipes/0/favorite/').status_code, 404)
+
+    def test_membership_flags(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        self.assertFalse(self.client.get(url).json()['is_favorited'])
+        self.post('/api/recipes/favorite/', [recipe.id])
+        self.assertTrue(self.client.get(url).json()['is_favorited'])
+        self.delete('/api/recipes/favorite/', [recipe.id])
+        self.assertFalse(self.client.get(url).json()['is_favorited'])
+
+    def test_counters(self):
+        ids = [recipe.id for recipe in self.recipes[:2]]
+        self.post('/api/recipes/favorite/', ids)
+        self.post('/api/recipes/favorite/', ids)
+        self.post('/api/recipes/shopping_cart/', ids)
+        self.assertEqual(
+            list(Recipe.objects.filter(id__in=ids).values_list(
+                'favorites_count', 'in_carts_count')),
+            [(1, 1), (1, 1)])
+        self.delete('/api/recipes/favorite/', ids)
+        self.delete('/api/recipes/favorite/', ids)
+        self.assertEqual(
+            list(Recipe.objects.filter(id__in=ids).values_list(
+                'favorites_count', flat=True)), [0, 0])
+
+    def test_shopping_list(self):
+        ids = [recipe.id for recipe in self.recipes[:2]]
+        self.post('/api/recipes/shopping_cart/', ids)
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                user=self.user).values_list('ingredient__name', 'amount')),
+            {'мука': 20, 'молоко': 40, 'яйцо': 60})
+        self.delete('/api/recipes/shopping_cart/', ids[:1])
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                user=self.user).values_list('ingredient__name', 'amount')),
+            {'мука': 10, 'молоко': 20, 'яйцо': 30})
+        # Запись мимо API тоже пересчитывает список.
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertFalse(
+            ShoppingListItem.objects.filter(user=self.user).exists())
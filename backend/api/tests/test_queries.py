@@ -0,0 +1,87 @@
+from api.inspection import inspect_queries
+from recipes.models import FavoriteRecipe, ShoppingCart
+from user.models import Subscribe
+
+from .base import APITestBase
+
+
+class HotEndpointQueriesTest(APITestBase):
+    '''Горячие эндпоинты на странице из нескольких рецептов разных
+    авторов: inspect_queries падает, если запрос повторяется по
+    объекту, то есть на каждый рецепт или автора.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for author in cls.authors:
+            Subscribe.objects.create(user=cls.user, author=author)
+            cls.create_recipe(author, 100 + author.id)
+        for recipe in cls.recipes:
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def get(self, url, client=None):
+        with inspect_queries(title=url):
+            response = (client or self.client).get(url)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+        self.assertEqual(response.status_code, 200, content[:200])
+        return response
+
+    def test_recipe_list(self):
+        for url in ('/api/recipes/', '/api/recipes/?is_favorited=1',
+                    '/api/recipes/?is_in_shopping_cart=1',
+                    '/api/recipes/?tags=breakfast&tags=lunch',
+                    '/api/recipes/?ordering=popular',
+                    '/api/recipes/?search=блины',
+                    '/api/recipes/?pagination=cursor'):
+            with self.subTest(url=url):
+                results = self.get(url).json()['results']
+                self.assertEqual(len(results), 6)
+        results = self.get('/api/recipes/?is_favorited=1').json()['results']
+        self.assertTrue(all(recipe['is_favorited'] for recipe in results))
+
+    def test_recipe_list_anonymous(self):
+        response = self.get('/api/recipes/', self.get_client())
+        self.assertEqual(len(response.json()['results']), 6)
+
+    def test_recipe_detail(self):
+        recipe = self.recipes[0]
+        data = self.get(f'/api/recipes/{recipe.id}/').json()
+        self.assertEqual(data['id'], recipe.id)
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['is_in_shopping_cart'])
+        self.assertEqual(len(data['ingredients']), len(self.ingredients))
+
+    def test_subscriptions(self):
+        data = self.get('/api/users/subscriptions/?recipes_limit=1').json()
+        self.assertEqual(data['count'], len(self.authors))
+        for author in data['results']:
+            self.assertEqual(len(author['recipes']), 1)
+            self.assertEqual(author['recipes_count'], 2)
+
+    def test_feed(self):
+        data = self.get('/api/recipes/feed/').json()
+        self.assertEqual(len(data['results']), 6)
+        self.assertIsNotNone(data['next'])
+        self.get(data['next'])
+
+    def test_download_shopping_cart(self):
+        for extension in ('txt', 'csv', 'json', 'pdf'):
+            with self.subTest(format=extension):
+                self.get(
+                    f'/api/recipes/download_shopping_cart/?format={extension}')
+
+    def test_bulk_lists(self):
+        ids = [recipe.id for recipe in self.recipes]
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(url=url):
+                with inspect_queries(title=url):
+                    removed = self.client.delete(url, {'ids': ids},
+                                                 format='json')
+                    added = self.client.post(url, {'ids': ids},
+                                             format='json')
+                self.assertEqual(removed.status_code, 200)
+                self.assertEqual(added.status_code, 200)
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import mimetypes
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser, DataAndFiles, MultiPartParser
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Файл картинки слишком большой.'
+    default_code = 'too_large'
+
+
+def get_extension(content_type):
+    extension = mimetypes.guess_extension(content_type.split(';')[0].strip())
+    return {'.jpe': '.jpg', '.jpeg': '.jpg'}.get(extension, extension or '')
+
+
+def write_upload(chunks, name, content_type):
+    '''Пишет поток кусков во временный файл на диске и обрывает
+    загрузку, как только превышен RECIPE_IMAGE_MAX_SIZE.'''
+    upload = TemporaryUploadedFile(name, content_type, 0, None)
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            upload.close()
+            raise RequestTooLarge()
+        upload.write(chunk)
+    upload.size = size
+    upload.seek(0)
+    return upload
+
+
+def close_with_request(request, upload):
+    '''Django закрывает файлы из request.FILES в конце запроса, так же
+    удаляется временный файл, если его не забрало хранилище.'''
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_files'):
+        request._files = MultiValueDict()
+    request._files.appendlist('image', upload)
+
+
+def decode_base64_image(data, request=None):
+    '''Декодирует data:image/...;base64 кусками во временный файл,
+    не создавая в памяти вторую копию картинки.'''
+    if ';base64,' not in data:
+        raise ParseError('Некорректная строка base64.')
+    header, encoded = data.split(';base64,', 1)
+    content_type = header[len('data:'):]
+    if len(encoded) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise RequestTooLarge()
+    step = CHUNK_SIZE // 3 * 4
+    try:
+        upload = write_upload(
+            (base64.b64decode(encoded[start:start + step])
+             for start in range(0, len(encoded), step)),
+            f'{uuid.uuid1()}{get_extension(content_type)}',
+            content_type
+        )
+    except (binascii.Error, ValueError):
+        raise ParseError('Некорректная строка base64.')
+    if request is not None:
+        close_with_request(request, upload)
+    return upload
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    '''Считает размер каждого файла multipart-запроса по мере чтения.'''
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise RequestTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class LimitedMultiPartParser(MultiPartParser):
+    '''multipart/form-data с ограничением размера файлов.'''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']._request
+        request.upload_handlers = [
+            MaxSizeUploadHandler(request), *request.upload_handlers
+        ]
+        return super().parse(stream, media_type, parser_context)
+
+
+class RawImageParser(BaseParser):
+    '''Тело запроса целиком является картинкой: PUT /recipes/{id}/image.
+    Картинка сразу пишется на диск и попадает в request.data['image'].'''
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if length > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise RequestTooLarge()
+        if stream is None:
+            raise ParseError('Пустое тело запроса.')
+        upload = write_upload(
+            iter(lambda: stream.read(CHUNK_SIZE), b''),
+            f'{uuid.uuid1()}{get_extension(media_type)}',
+            media_type
+        )
+        close_with_request(request, upload)
+        return DataAndFiles({}, {'image': upload})
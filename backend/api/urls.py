@@ -1,4 +1,5 @@
-from api.views import IngredientsViewSet, RecipeViewSet, TagViewSet
+from api.views import (IngredientsViewSet, MetricsView, RecipeViewSet,
+                       TagViewSet)
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from user.views import CustomUserViewSet
@@ -14,4 +15,5 @@ router.register('users', CustomUserViewSet, 'users')
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,14 +1,147 @@
+import csv
+import hashlib
+import json
+import os
+import tempfile
+from itertools import chain
+
+from django.conf import settings
+from rest_framework.negotiation import DefaultContentNegotiation
+
+EXPORTERS = {}
+
+
+def register_exporter(name, content_type, cached=False):
+    '''Регистрирует формат выгрузки списка покупок.
+
+    Обычный экспортер - генератор строк для StreamingHttpResponse;
+    cached-экспортер пишет файл целиком и кэшируется на диске.
+    '''
+    def decorator(func):
+        EXPORTERS[name] = {
+            'render': func,
+            'content_type': content_type,
+            'cached': cached,
+        }
+        return func
+    return decorator
+
+
+def get_filename(user, extension):
+    return f'{user.username}_shopping_list.{extension}'
+
+
+class Echo:
+    '''Псевдо-файл для csv.writer: возвращает строку вместо записи.'''
+
+    def write(self, value):
+        return value
+
+
+@register_exporter('txt', 'text/plain; charset=utf-8')
 def create_txt(user, ingredients_value):
     """Создание txt-файла."""
-    first_string = (
-        f'Список покупок пользователя {user.get_full_name()} \n\n'
+    yield f'Список покупок пользователя {user.get_full_name()} \n\n'
+    for number, ing in enumerate(ingredients_value):
+        yield (f'{chr(10) if number else ""}{ing["ingredient__name"]} '
+               f'{ing["amount"]} '
+               f'{ing["ingredient__measurement_unit"]}')
+    yield '\n\n\nFoodgram project'
+
+
+@register_exporter('csv', 'text/csv; charset=utf-8')
+def create_csv(user, ingredients_value):
+    """Создание csv-файла."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ing in ingredients_value:
+        yield writer.writerow((ing['ingredient__name'], ing['amount'],
+                               ing['ingredient__measurement_unit']))
+
+
+@register_exporter('json', 'application/json')
+def create_json(user, ingredients_value):
+    """Создание json-файла."""
+    yield '{"user": %s, "ingredients": [' % json.dumps(user.username)
+    for number, ing in enumerate(ingredients_value):
+        yield (',' if number else '') + json.dumps({
+            'name': ing['ingredient__name'],
+            'amount': ing['amount'],
+            'measurement_unit': ing['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+    yield ']}'
+
+
+@register_exporter('pdf', 'application/pdf', cached=True)
+def create_pdf(user, ingredients_value, path):
+    """Создание pdf-файла."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font = 'Helvetica'
+    if os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        font = 'ShoppingListFont'
+        if font not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(font, settings.SHOPPING_LIST_PDF_FONT))
+    pdf = canvas.Canvas(path, pagesize=A4)
+    _, height = A4
+    lines = chain(
+        [f'Список покупок пользователя {user.get_full_name()}', ''],
+        (f'{ing["ingredient__name"]} {ing["amount"]} '
+         f'{ing["ingredient__measurement_unit"]}'
+         for ing in ingredients_value),
+        ['', 'Foodgram project']
     )
-    shoping_list = '\n'.join([f'{ing["ingredient__name"]} '
-                              f'{ing["amount"]} '
-                              f'{ing["ingredient__measurement_unit"]}'
-                              for ing in ingredients_value])
-    footer = '\n\n\nFoodgram project'
-
-    ready_list = first_string + shoping_list + footer
-    filename = f'{user.username}_shopping_list.txt'
-    return ready_list, filename
\ No newline at end of file
+    y = height - 50
+    pdf.setFont(font, 12)
+    for line in lines:
+        if y < 50:
+            pdf.showPage()
+            pdf.setFont(font, 12)
+            y = height - 50
+        pdf.drawString(50, y, line)
+        y -= 18
+    pdf.save()
+
+
+def get_cached_export(user, ingredients_value, extension, render):
+    '''Путь к файлу выгрузки для текущего состава корзины.
+
+    Имя файла содержит хэш строк списка, поэтому неизменившаяся
+    корзина отдается готовым файлом. У каждого пользователя свой
+    каталог, старые версии удаляются только из него.
+    '''
+    rows = list(ingredients_value)
+    digest = hashlib.sha256(
+        repr((user.get_full_name(), rows)).encode()).hexdigest()[:32]
+    directory = os.path.join(settings.SHOPPING_LIST_CACHE_DIR, str(user.id))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{digest}.{extension}')
+    if os.path.exists(path):
+        return path
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(handle)
+    try:
+        render(user, rows, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    for entry in os.scandir(directory):
+        if entry.name.endswith(f'.{extension}') and entry.path != path:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Параллельный запрос того же пользователя успел удалить.
+                pass
+    return path
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    '''?format= выбирает формат файла, а не рендерер DRF.'''
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
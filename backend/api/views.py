@@ -1,23 +1,41 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import hashlib
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
-                            Recipe, ShoppingCart, Tag)
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from recipes.signals import COUNTERS
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.permissions import (SAFE_METHODS, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import LimitPageNumberPagination
-from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
+from .cache import bump_version_on_commit, get_version, get_versions
+from .catalog import ingredients_catalog, tags_catalog
+from .feed import FeedQuerySet
+from .filters import RecipeFilter
+from .membership import MEMBERSHIP_KINDS, invalidate_member_ids
+from .metrics import collect, render
+from .mixins import ConditionalGetMixin
+from .pagination import CachedCountPagination, RecipeCursorPagination
+from .permissions import (IsAdminOrReadOnly, IsAuthorOrReadOnly,
+                          IsStaffOrMetricsToken)
+from .search import search_ingredients
 from .serializers import (CropRecipeSerializer, IngredientSerializer,
+                          RecipeIdsSerializer, RecipeImageSerializer,
                           RecipeReadSerializer, RecipeWriteSerializer,
                           TagSerializer)
-from .utils import create_txt
+from .uploads import LimitedMultiPartParser, RawImageParser
+from .utils import (EXPORTERS, ExportContentNegotiation, get_cached_export,
+                    get_filename)
 
 
 class TagViewSet(ReadOnlyModelViewSet):
@@ -27,23 +45,124 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (IsAdminOrReadOnly,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == 'json':
+            return tags_catalog.response(request)
+        return super().list(request, *args, **kwargs)
+
 
 class IngredientsViewSet(ReadOnlyModelViewSet):
     '''Вьюсет для ингредиентов'''
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (IngredientSearchFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        '''Поиск по ?name= идет по индексу в памяти процесса,
+        ?fuzzy=1 включает поиск с опечатками.'''
+        name = request.query_params.get('name', '')
+        if not name and request.accepted_renderer.format == 'json':
+            return ingredients_catalog.response(request)
+        fuzzy = request.query_params.get('fuzzy') not in (None, '', '0')
+        return Response(search_ingredients(name, fuzzy=fuzzy))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
-    pagination_class = LimitPageNumberPagination
+    pagination_class = CachedCountPagination
     permission_classes = (IsAdminOrReadOnly | IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    cursor_pagination_class = RecipeCursorPagination
+    parser_classes = (JSONParser, LimitedMultiPartParser, FormParser)
+
+    @property
+    def paginator(self):
+        '''Курсорная пагинация включается параметром ?pagination=cursor,
+        по умолчанию остается постраничная.'''
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return (self.pagination_class is not None
+                and (params.get('pagination') == 'cursor'
+                     or 'cursor' in params))
+
+    def get_count_cache_key(self):
+        '''Нормализованный ключ фильтров для кэша количества рецептов.'''
+        params = self.request.query_params
+        user = self.request.user
+        key = [
+            'recipes', get_version('recipes'),
+            params.get('author', ''),
+            sorted(set(params.getlist('tags'))),
+        ]
+        personal = [
+            name for name in ('is_favorited', 'is_in_shopping_cart')
+            if params.get(name) not in (None, '', '0')
+        ]
+        if personal and user.is_authenticated:
+            key += [personal, user.id, get_version('user', user.id)]
+        search = ' '.join(params.get('search', '').lower().split())
+        if search:
+            key += [search, get_version('search', 'recipes')]
+        return key
+
+    def get_validators(self, parts, updated_at, version_parts):
+        '''ETag и Last-Modified из дешевых меток версий.
+
+        Метки версий - миллисекунды времени последнего изменения,
+        поэтому максимум из них годится для Last-Modified.
+        '''
+        user = self.request.user
+        if user.is_authenticated:
+            version_parts += [('membership', kind, user.id) for kind
+                              in ('favorites', 'cart', 'subscriptions')]
+        version_parts += [('catalog', 'tags'), ('catalog', 'ingredients')]
+        versions = get_versions(version_parts)
+        parts += [user.id] + sorted(versions.items())
+        etag = '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+        last_modified = max(
+            [version // 1000 for version in versions.values()]
+            + [int(updated_at.timestamp()) if updated_at else 0]
+        )
+        return etag, last_modified
+
+    def get_list_validators(self):
+        '''Без запросов к базе: версия recipes меняется при любом
+        сохранении и удалении рецепта, смене его тегов и ингредиентов,
+        отдельные метки есть у профилей и счетчиков.'''
+        return self.get_validators(
+            ['list', self.request.get_full_path()], None,
+            [('recipes',), ('profiles',), ('counters',)])
+
+    def get_detail_validators(self):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            lookup = int(lookup)
+        except (TypeError, ValueError):
+            # Некорректный id получит 404 в get_object.
+            return None
+        recipe = Recipe.objects.filter(pk=lookup).values(
+            'updated_at', 'author_id', 'favorites_count',
+            'in_carts_count').first()
+        if recipe is None:
+            return None
+        return self.get_validators(
+            ['detail', lookup, recipe['updated_at'],
+             recipe['favorites_count'], recipe['in_carts_count']],
+            recipe['updated_at'],
+            [('profile', recipe['author_id']), ('counters', lookup)])
+
+    def get_queryset(self):
+        '''Теги и ингредиенты подгружаются в RecipeReadSerializer только
+        для рецептов, которых нет в кэше фрагментов. Персональные флаги
+        берутся из кэша Membership, а не из базы. Поисковый вектор
+        нужен только в WHERE и ORDER BY и в выборку не попадает.'''
+        return Recipe.objects.select_related('author').defer('search_vector')
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -53,6 +172,29 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=False, methods=['GET'],
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        '''Новые рецепты авторов, на которых подписан пользователь.'''
+        paginator = self.cursor_pagination_class()
+        page = paginator.paginate_queryset(
+            FeedQuerySet(request.user), request, view=self)
+        serializer = RecipeReadSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['PUT'], url_path='image',
+            parser_classes=(RawImageParser, LimitedMultiPartParser))
+    def image(self, request, pk=None):
+        '''Загрузка картинки телом запроса (Content-Type: image/*)
+        или полем image в multipart, без base64.'''
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(recipe, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(
+            RecipeReadSerializer(recipe, context={'request': request}).data)
+
     @action(detail=True, methods=['POST', 'DELETE'],
             permission_classes=(IsAuthenticated,),)
     def favorite(self, request, pk=None):
@@ -71,20 +213,99 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.delete_obj(ShoppingCart, request.user, pk)
         return None
 
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='favorite', permission_classes=(IsAuthenticated,))
+    def favorite_bulk(self, request):
+        '''Пакетное добавление и удаление избранного: {"ids": [...]}'''
+        return self.bulk_obj(FavoriteRecipe, request)
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='shopping_cart', permission_classes=(IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        '''Пакетное добавление и удаление покупок: {"ids": [...]}'''
+        return self.bulk_obj(ShoppingCart, request)
+
+    def bulk_obj(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            results, _ = self.add_recipes(model, request.user, ids)
+        else:
+            results = self.remove_recipes(model, request.user, ids)
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
+
+    @transaction.atomic
+    def add_recipes(self, model, user, ids):
+        '''Добавляет рецепты в список пользователя.
+
+        Все id проверяются одним запросом, вставка идет через
+        INSERT ... ON CONFLICT DO NOTHING RETURNING: счетчики, кэши
+        и статусы меняются только для реально вставленных строк, даже
+        если такой же запрос выполняется параллельно. Возвращает статус
+        по каждому id и словарь найденных рецептов.
+        '''
+        recipes = Recipe.objects.in_bulk(ids)
+        added = model.objects.add(user.id, recipes)
+        if added:
+            # Вставка мимо ORM не отправляет сигналы post_save.
+            Recipe.objects.change_counters(added, COUNTERS[model], 1)
+            kind, _ = MEMBERSHIP_KINDS[model]
+            transaction.on_commit(
+                lambda: invalidate_member_ids(kind, user.id))
+            bump_version_on_commit('user', user.id)
+            if model is ShoppingCart:
+                ShoppingListItem.objects.refresh([user.id], recipe_ids=added)
+        return {
+            pk: ('not_found' if pk not in recipes
+                 else 'added' if pk in added
+                 else 'already_added')
+            for pk in ids
+        }, recipes
+
+    @transaction.atomic
+    def remove_recipes(self, model, user, ids):
+        '''Удаляет рецепты из списка пользователя одним запросом;
+        счетчики, множество Membership и версия обновляются один раз
+        на весь пакет, как в add_recipes.'''
+        removed = model.objects.remove(user.id, ids)
+        if removed:
+            Recipe.objects.change_counters(removed, COUNTERS[model], -1)
+            kind, _ = MEMBERSHIP_KINDS[model]
+            transaction.on_commit(
+                lambda: invalidate_member_ids(kind, user.id))
+            bump_version_on_commit('user', user.id)
+            if model is ShoppingCart:
+                ShoppingListItem.objects.refresh(
+                    [user.id], recipe_ids=removed)
+        return {
+            pk: 'removed' if pk in removed else 'not_in_list'
+            for pk in ids
+        }
+
+    def get_recipe_id(self, pk):
+        try:
+            return int(pk)
+        except ValueError:
+            raise Http404
+
     def add_obj(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        pk = self.get_recipe_id(pk)
+        results, recipes = self.add_recipes(model, user, [pk])
+        if results[pk] == 'not_found':
+            raise Http404
+        if results[pk] == 'already_added':
             return Response({
                 'errors': 'Рецепт уже добавлен в список'
             }, status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
-        serializer = CropRecipeSerializer(recipe)
+        serializer = CropRecipeSerializer(recipes[pk])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_obj(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        pk = self.get_recipe_id(pk)
+        if self.remove_recipes(model, user, [pk])[pk] == 'removed':
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({
             'errors': 'Рецепт уже удален'
@@ -94,21 +315,50 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         methods=('get',),
         url_path='download_shopping_cart',
-        pagination_class=None)
+        pagination_class=None,
+        content_negotiation_class=ExportContentNegotiation)
     def download_file(self, request):
+        '''Выгрузка списка покупок: ?format=txt|csv|json|pdf.'''
         user = request.user
-        if not ShoppingCart.objects.filter(user_id=user.id).exists():
+        extension = request.query_params.get('format', 'txt')
+        exporter = EXPORTERS.get(extension)
+        if exporter is None:
             return Response(
-                'В корзине нет товаров', status=status.HTTP_400_BAD_REQUEST)
-
-        ingredients = IngredientAmount.objects.filter(
-            recipe__purchase__user=user
-        )
-        ingredients_value = ingredients.values(
+                {'errors': f'Доступные форматы: {", ".join(EXPORTERS)}'},
+                status=status.HTTP_400_BAD_REQUEST)
+        ingredients = ShoppingListItem.objects.filter(
+            user_id=user.id
+        ).values(
             'ingredient__name',
             'ingredient__measurement_unit',
-        ).annotate(amount=Sum('amount'))
-        ready_list, filename = create_txt(user, ingredients_value)
-        response = HttpResponse(ready_list, content_type='text/plain')
+            'amount',
+        ).order_by('ingredient__name').iterator(chunk_size=500)
+        first = next(ingredients, None)
+        if first is None:
+            return Response(
+                'В корзине нет товаров', status=status.HTTP_400_BAD_REQUEST)
+        ingredients_value = chain([first], ingredients)
+        filename = get_filename(user, extension)
+        if exporter['cached']:
+            path = get_cached_export(
+                user, ingredients_value, extension, exporter['render'])
+            return FileResponse(
+                open(path, 'rb'), as_attachment=True, filename=filename,
+                content_type=exporter['content_type'])
+        response = StreamingHttpResponse(
+            exporter['render'](user, ingredients_value),
+            content_type=exporter['content_type'])
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+
+
+class MetricsView(APIView):
+    '''Метрики всех воркеров в текстовом формате Prometheus.'''
+    permission_classes = (IsStaffOrMetricsToken,)
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        return HttpResponse(
+            render(collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,5 @@
 import os
+import sys
 from datetime import timedelta
 
 from dotenv import load_dotenv
@@ -25,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'user.apps.UserConfig',
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
@@ -62,6 +64,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.inspection.QueryInspectionMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -100,6 +104,106 @@ DATABASES = {
 }
 
 
+# Метки версий, фрагменты рецептов, множества Membership и счетчики
+# пагинации общие для всех воркеров, в работе нужен общий кэш в памяти:
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://redis:6379/1 (см. infra/example.env).
+# Файловый кэш по умолчанию только для разработки: FileBasedCache
+# на каждой записи обходит весь каталог кэша в _cull().
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')
+        ),
+    }
+}
+
+# Количество объектов для пагинации кэшируется на короткое время,
+# для больших таблиц без фильтров берется оценка планировщика.
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=60))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000))
+
+# Множества избранного, корзины и подписок пользователя.
+MEMBERSHIP_CACHE_TIMEOUT = int(
+    os.getenv('MEMBERSHIP_CACHE_TIMEOUT', default=60 * 60))
+
+# Общие для всех пользователей части ответа RecipeReadSerializer.
+RECIPE_FRAGMENT_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FRAGMENT_CACHE_TIMEOUT', default=24 * 60 * 60))
+
+# Максимальное число подсказок при поиске ингредиента по названию.
+INGREDIENT_SEARCH_LIMIT = int(
+    os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+# Порог сходства (pg_trgm similarity) для поиска с опечатками.
+INGREDIENT_TRIGRAM_THRESHOLD = float(
+    os.getenv('INGREDIENT_TRIGRAM_THRESHOLD', default=0.3))
+
+# Кэш сгенерированных файлов списка покупок, по каталогу на пользователя,
+# и шрифт с кириллицей для PDF. Каталог лежит вне CACHE_LOCATION: файлы
+# кэша Django и выгрузки не должны удаляться очисткой друг друга.
+SHOPPING_LIST_CACHE_DIR = os.getenv(
+    'SHOPPING_LIST_CACHE_DIR',
+    default=os.path.join(BASE_DIR, 'var', 'shopping_lists'))
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Обработка картинок рецептов: thread - пул потоков в процессе,
+# queue - очередь в БД для manage.py process_images, sync - без фона.
+RECIPE_IMAGE_PROCESSING = os.getenv(
+    'RECIPE_IMAGE_PROCESSING', default='thread')
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+RECIPE_IMAGE_MAX_ATTEMPTS = int(
+    os.getenv('RECIPE_IMAGE_MAX_ATTEMPTS', default=3))
+# Размеры вариантов (по большей стороне) и их формат: WEBP или JPEG.
+RECIPE_IMAGE_THUMBNAIL_SIZE = int(
+    os.getenv('RECIPE_IMAGE_THUMBNAIL_SIZE', default=480))
+RECIPE_IMAGE_DETAIL_SIZE = int(
+    os.getenv('RECIPE_IMAGE_DETAIL_SIZE', default=1280))
+RECIPE_IMAGE_VARIANT_FORMAT = os.getenv(
+    'RECIPE_IMAGE_VARIANT_FORMAT', default='WEBP')
+# Предельный размер загружаемой картинки в байтах, проверяется при чтении.
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024))
+
+# Лента подписок: рецепты авторов с большим числом подписчиков не
+# рассылаются по лентам, а подмешиваются при чтении.
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('FEED_FANOUT_MAX_FOLLOWERS', default=1000))
+# Рассылка нового рецепта: thread - пул потоков обработки картинок,
+# queue - manage.py fanout_feed --loop, sync - после коммита в запросе.
+FEED_FANOUT_PROCESSING = os.getenv('FEED_FANOUT_PROCESSING', default='thread')
+# Сколько последних рецептов автора попадает в ленту при подписке.
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', default=100))
+
+# Метрики запросов для Prometheus на /api/metrics/. Воркеры пишут свои
+# значения в общий каталог раз в METRICS_FLUSH_INTERVAL секунд. Каталог
+# лежит вне CACHE_LOCATION, как и выгрузки списка покупок.
+METRICS_ENABLED = (os.getenv('METRICS_ENABLED') == 'True')
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', default=os.path.join(BASE_DIR, 'var', 'metrics'))
+METRICS_FLUSH_INTERVAL = float(
+    os.getenv('METRICS_FLUSH_INTERVAL', default=10))
+# Токен для Prometheus: Authorization: Bearer <METRICS_TOKEN>.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+
+# Поиск N+1 для разработки: off, log - предупреждения в лог,
+# raise - ошибка. В manage.py test включен по умолчанию.
+QUERY_INSPECTION = os.getenv(
+    'QUERY_INSPECTION',
+    default='raise' if sys.argv[1:2] == ['test'] else 'off')
+# Сколько раз за запрос может повториться одна форма SQL.
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', default=5))
+# Порог медленного запроса в мс, такие пишутся в лог с планом EXPLAIN.
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', default=100))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -137,6 +241,10 @@ IMPORT_DATA_ADRESS = os.path.join(BASE_DIR, 'data')
 STATIC_ROOT = os.path.join(BASE_DIR, 'static', 'django')
 MEDIA_URL = '/media/django/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media', 'django')
+# Файлы хранятся под хэшем содержимого, одинаковые загрузки не дублируются.
+DEFAULT_FILE_STORAGE = os.getenv(
+    'DEFAULT_FILE_STORAGE',
+    default='recipes.storage.ContentAddressedStorage')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
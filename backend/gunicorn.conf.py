@@ -0,0 +1,16 @@
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+
+def on_starting(server):
+    # Метрики прошлого запуска не должны попасть в сумму.
+    from api.metrics import clear
+
+    clear()
+
+
+def child_exit(server, worker):
+    from api.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
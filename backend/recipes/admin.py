@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import FavoriteRecipe, Ingredient, IngredientAmount, Recipe, Tag
+from .images import enqueue_recipe_image
+from .models import Ingredient, IngredientAmount, Recipe, Tag
 
 
 class IngredientAmountAdmin(admin.StackedInline):
@@ -16,9 +17,15 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name', 'author__email', 'tag__name')
     inlines = (IngredientAmountAdmin,)
 
-    @admin.display(description='Количество в избранных у пользователя')
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            enqueue_recipe_image(obj)
+
+    @admin.display(description='Количество в избранных у пользователя',
+                   ordering='favorites_count')
     def added_to_favorites(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
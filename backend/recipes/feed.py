@@ -0,0 +1,47 @@
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .images import get_executor
+from .models import FeedEntry, Recipe
+
+logger = logging.getLogger(__name__)
+
+
+def run_fan_out(recipe_id):
+    '''Рассылает рецепт, если его еще не разослали; удаленный или
+    уже разосланный рецепт пропускается.'''
+    recipe = Recipe.objects.filter(
+        id=recipe_id, feed_fanout=False
+    ).only('id', 'author_id', 'pub_date').first()
+    if recipe is None:
+        return False
+    return FeedEntry.objects.fan_out(recipe)
+
+
+def run_in_thread(recipe_id):
+    try:
+        run_fan_out(recipe_id)
+    except Exception:
+        # Рецепт остается неразосланным: его покажет чтение ленты,
+        # а разошлет manage.py fanout_feed.
+        logger.exception('Feed fan-out of recipe %s failed', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue_fan_out(recipe):
+    '''Рассылает новый рецепт по лентам подписчиков вне запроса.
+
+    Режим FEED_FANOUT_PROCESSING: thread - пул потоков обработки
+    картинок, queue - рецепты забирает manage.py fanout_feed, sync -
+    сразу после коммита в текущем потоке. Пока рецепт не разослан,
+    лента подмешивает его при чтении.
+    '''
+    mode = settings.FEED_FANOUT_PROCESSING
+    if mode == 'thread':
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_thread, recipe.id))
+    elif mode == 'sync':
+        transaction.on_commit(lambda: run_fan_out(recipe.id))
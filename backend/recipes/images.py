@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from .models import ImageTask, Recipe
+
+logger = logging.getLogger(__name__)
+
+# Поле модели и максимальный размер стороны варианта картинки.
+VARIANTS = (
+    ('image_thumbnail', settings.RECIPE_IMAGE_THUMBNAIL_SIZE),
+    ('image_detail', settings.RECIPE_IMAGE_DETAIL_SIZE),
+)
+ORIGINAL_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def encode(image, image_format, **options):
+    '''Кодирует картинку без EXIF и прочих метаданных.'''
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def process_recipe_image(recipe):
+    '''Проверяет оригинал, удаляет из него метаданные и строит
+    уменьшенные варианты в формате RECIPE_IMAGE_VARIANT_FORMAT.
+
+    Возвращает False, если пока шла обработка, у рецепта сменилась
+    картинка: результат для старой картинки не записывается.
+    '''
+    source_name = recipe.image.name
+    with recipe.image.open('rb') as source:
+        Image.open(source).verify()
+        source.seek(0)
+        image = Image.open(source)
+        image.load()
+    image_format = image.format
+    image = ImageOps.exif_transpose(image)
+    base = os.path.splitext(os.path.basename(source_name))[0]
+
+    extension = ORIGINAL_FORMATS.get(image_format)
+    if extension is None:
+        image_format, extension = 'PNG', 'png'
+    files = {'image': (f'{base}.{extension}',
+                       encode(image, image_format, quality=90))}
+    variant_format = settings.RECIPE_IMAGE_VARIANT_FORMAT
+    for field, size in VARIANTS:
+        variant = image.copy()
+        variant.thumbnail((size, size))
+        files[field] = (f'{base}.{variant_format.lower()}',
+                        encode(variant, variant_format, quality=80))
+    with transaction.atomic():
+        # Файлы пишутся в транзакции: хранилище держит на них ссылку
+        # до коммита, и результат вытесненной задачи потом удаляется.
+        for field, (name, content) in files.items():
+            getattr(recipe, field).save(name, ContentFile(content),
+                                        save=False)
+        # Строка рецепта блокируется, новая загрузка не проскочит между
+        # проверкой имени картинки и записью.
+        current = Recipe.objects.select_for_update().filter(
+            id=recipe.id).first()
+        if current is None or current.image.name != source_name:
+            return False
+        for field in files:
+            setattr(current, field, getattr(recipe, field).name)
+        current.save(update_fields=[*files, 'updated_at'])
+    return True
+
+
+def run_image_task(task_id):
+    '''Захватывает задачу условным UPDATE, поэтому одну задачу не
+    обработают одновременно поток и команда process_images.'''
+    claimed = ImageTask.objects.filter(
+        id=task_id, status=ImageTask.PENDING
+    ).update(status=ImageTask.PROCESSING, attempts=F('attempts') + 1)
+    if not claimed:
+        return
+    task = ImageTask.objects.select_related('recipe').get(id=task_id)
+    try:
+        processed = process_recipe_image(task.recipe)
+    except Exception as error:
+        logger.exception('Image task %s failed', task_id)
+        status = (ImageTask.PENDING
+                  if task.attempts < settings.RECIPE_IMAGE_MAX_ATTEMPTS
+                  else ImageTask.FAILED)
+        ImageTask.objects.filter(id=task_id).update(
+            status=status, error=str(error))
+    else:
+        # Задачу старой картинки вытеснила новая загрузка.
+        ImageTask.objects.filter(id=task_id).update(
+            status=ImageTask.DONE,
+            error='' if processed else 'Картинка рецепта заменена')
+
+
+def run_in_thread(task_id):
+    try:
+        run_image_task(task_id)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    return _executor
+
+
+def enqueue_recipe_image(recipe):
+    '''Ставит картинку рецепта в очередь на обработку.
+
+    Режим RECIPE_IMAGE_PROCESSING: thread - пул потоков в процессе,
+    queue - задачи забирает manage.py process_images, sync - сразу
+    после коммита в текущем потоке.
+    '''
+    # Варианты старой картинки больше не подходят, до конца обработки
+    # сериализаторы отдают новый оригинал. Старые файлы удалит MediaFile.
+    if any(getattr(recipe, field) for field, _ in VARIANTS):
+        for field, _ in VARIANTS:
+            setattr(recipe, field, '')
+        recipe.save(update_fields=[field for field, _ in VARIANTS])
+    task = ImageTask.objects.create(recipe=recipe)
+    mode = settings.RECIPE_IMAGE_PROCESSING
+    if mode == 'thread':
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_thread, task.id))
+    elif mode == 'sync':
+        transaction.on_commit(lambda: run_image_task(task.id))
+    return task
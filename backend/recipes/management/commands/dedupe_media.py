@@ -0,0 +1,101 @@
+import os
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from recipes.models import MediaFile, Recipe
+from recipes.signals import IMAGE_FIELDS
+from recipes.storage import (HASHED_NAME, ContentAddressedStorage,
+                             get_content_hash, get_hashed_name)
+
+
+class Command(BaseCommand):
+    help = ('Move recipe images to content-addressed names, remove '
+            'duplicates and rebuild media reference counts')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be changed'
+        )
+        parser.add_argument(
+            '--delete-orphans',
+            action='store_true',
+            help='Delete files under recipe/ not used by any recipe'
+        )
+
+    def handle(self, *args, **kwargs):
+        if not isinstance(default_storage._wrapped, ContentAddressedStorage):
+            raise CommandError(
+                'DEFAULT_FILE_STORAGE must be ContentAddressedStorage')
+        dry_run = kwargs['dry_run']
+        renamed = {}
+        missing = 0
+        for recipe in Recipe.objects.values('id', *IMAGE_FIELDS).iterator():
+            changes = {}
+            for field in IMAGE_FIELDS:
+                name = recipe[field]
+                if not name or HASHED_NAME.search(name):
+                    continue
+                if name not in renamed:
+                    if not default_storage.exists(name):
+                        missing += 1
+                        self.stderr.write(f'Missing file: {name}')
+                        continue
+                    renamed[name] = self.rename(name, dry_run)
+                changes[field] = renamed[name]
+            if changes and not dry_run:
+                Recipe.objects.filter(id=recipe['id']).update(
+                    updated_at=timezone.now(), **changes)
+        targets = Counter(renamed.values())
+        print(f'Renamed {len(renamed)} files, '
+              f'{len(renamed) - len(targets)} duplicates, '
+              f'{missing} missing')
+        if dry_run:
+            return
+        for name in renamed:
+            default_storage.delete(name)
+        self.rebuild_refs()
+        if kwargs['delete_orphans']:
+            self.delete_orphans()
+
+    def rename(self, name, dry_run):
+        with default_storage.open(name, 'rb') as content:
+            if dry_run:
+                return get_hashed_name(name, get_content_hash(content))
+            return default_storage.save(name, content)
+
+    def rebuild_refs(self):
+        refs = Counter()
+        for names in Recipe.objects.values_list(*IMAGE_FIELDS).iterator():
+            refs.update(name for name in names if name)
+        MediaFile.objects.bulk_create(
+            [MediaFile(name=name, refs=count)
+             for name, count in refs.items()],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=('name',),
+            update_fields=('refs',)
+        )
+        unused = list(MediaFile.objects.exclude(
+            name__in=refs).values_list('name', flat=True))
+        MediaFile.objects.filter(name__in=unused).update(refs=0)
+        MediaFile.objects.collect(unused)
+        print(f'Counted references to {len(refs)} files, '
+              f'removed {len(unused)} unused')
+
+    def delete_orphans(self):
+        used = set(MediaFile.objects.values_list('name', flat=True))
+        root = default_storage.path('')
+        deleted = 0
+        for directory, _, files in os.walk(default_storage.path('recipe')):
+            for file_name in files:
+                name = os.path.relpath(
+                    os.path.join(directory, file_name), root)
+                if name in used or name.endswith('.tmp'):
+                    continue
+                default_storage.delete(name)
+                deleted += 1
+        print(f'Deleted {deleted} orphan files')
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.models import FeedEntry, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Fan out recipes that are not yet in subscribers feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new recipes (FEED_FANOUT_PROCESSING=queue)'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2,
+            help='Seconds between polls'
+        )
+
+    def handle(self, *args, **kwargs):
+        # Рецепты авторов с большим числом подписчиков остаются
+        # неразосланными, поэтому каждый проход продолжает с последнего id.
+        last_id = 0
+        while True:
+            done = skipped = 0
+            recipes = Recipe.objects.filter(
+                feed_fanout=False, id__gt=last_id
+            ).only('id', 'author_id', 'pub_date').order_by('id')
+            for recipe in recipes.iterator():
+                if FeedEntry.objects.fan_out(recipe):
+                    done += 1
+                else:
+                    skipped += 1
+                last_id = recipe.id
+            if done or skipped or not kwargs['loop']:
+                print(f'Fanned out {done} recipes, {skipped} left for '
+                      'read-time merge')
+            if not kwargs['loop']:
+                return
+            time.sleep(kwargs['sleep'])
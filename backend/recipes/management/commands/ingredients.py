@@ -1,11 +1,65 @@
 import csv
+import json
+import time
 
-from django.core.management.base import BaseCommand
+from api.cache import bump_version_on_commit
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json(file):
+    '''Построчно читает JSON-массив или JSON Lines, не загружая файл
+    целиком.'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[,':
+            position += 1
+        if buffer[position:position + 1] == ']':
+            return
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                if buffer[position:].strip():
+                    raise CommandError('Broken JSON at the end of file')
+                return
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+
+
+def iter_csv(file):
+    for row in csv.reader(file, dialect='excel'):
+        if row and row[:2] == ['name', 'measurement_unit']:
+            continue
+        yield row
+
+
+def get_values(row):
+    '''(name, measurement_unit) из строки CSV, фикстуры Django
+    или словаря; None для некорректной строки.'''
+    if isinstance(row, dict):
+        row = row.get('fields', row)
+        row = [row.get('name'), row.get('measurement_unit')]
+    if not isinstance(row, list) or len(row) < 2:
+        return None
+    name, unit = (str(value or '').strip() for value in row[:2])
+    if not name or not unit or len(name) > 100 or len(unit) > 100:
+        return None
+    return name, unit
+
 
 class Command(BaseCommand):
-    help = 'Import CSV data for Ingredients'
+    help = 'Import ingredients from a CSV or JSON file'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -13,16 +67,71 @@ class Command(BaseCommand):
             type=str,
             help='Ingredients file path'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per insert batch'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Roll back the import and only report counts'
+        )
 
     def handle(self, *args, **kwargs):
-        path = kwargs.get('path')
-        with open(path, 'rt', encoding='utf-8') as f:
-            reader = csv.reader(f, dialect='excel')
-            count = 0
-            for row in reader:
-                count += 1
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
-            print(f'Import {count} ingredients completed successfully')
\ No newline at end of file
+        started = time.perf_counter()
+        self.inserted = self.skipped = self.invalid = 0
+        self.seen = set()
+        with open(kwargs['path'], 'rt', encoding='utf-8-sig') as file:
+            first = file.read(1)
+            while first.isspace():
+                first = file.read(1)
+            file.seek(0)
+            rows = (iter_json(file) if first and first in '[{'
+                    else iter_csv(file))
+            with transaction.atomic():
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= kwargs['batch_size']:
+                        self.import_batch(batch)
+                        batch = []
+                self.import_batch(batch)
+                if kwargs['dry_run']:
+                    transaction.set_rollback(True)
+                elif self.inserted:
+                    # bulk_create не отправляет сигналы, каталог и индекс
+                    # поиска ингредиентов сбрасываются явно.
+                    bump_version_on_commit('catalog', 'ingredients')
+        elapsed = time.perf_counter() - started
+        total = self.inserted + self.skipped + self.invalid
+        print(f'{"Dry run: " if kwargs["dry_run"] else ""}'
+              f'{self.inserted} inserted, {self.skipped} skipped, '
+              f'{self.invalid} invalid in {elapsed:.2f}s '
+              f'({total / elapsed if elapsed else total:.0f} rows/s)')
+
+    def import_batch(self, rows):
+        values = []
+        for row in rows:
+            value = get_values(row)
+            if value is None:
+                self.invalid += 1
+            elif value in self.seen:
+                self.skipped += 1
+            else:
+                self.seen.add(value)
+                values.append(value)
+        if not values:
+            return
+        existing = set(Ingredient.objects.filter(
+            name__in=[name for name, _ in values]
+        ).values_list('name', 'measurement_unit'))
+        new = [value for value in values if value not in existing]
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in new],
+            ignore_conflicts=True
+        )
+        self.inserted += len(new)
+        self.skipped += len(values) - len(new)
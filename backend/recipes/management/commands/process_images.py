@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.images import run_image_task
+from recipes.models import ImageTask
+
+
+class Command(BaseCommand):
+    help = 'Process queued recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process pending tasks and exit'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2,
+            help='Seconds between queue polls'
+        )
+        parser.add_argument(
+            '--retry-stale',
+            action='store_true',
+            help='Requeue tasks left in processing state by a crashed worker'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['retry_stale']:
+            stale = ImageTask.objects.filter(
+                status=ImageTask.PROCESSING
+            ).update(status=ImageTask.PENDING)
+            print(f'Requeued {stale} tasks')
+        while True:
+            task_ids = list(ImageTask.objects.filter(
+                status=ImageTask.PENDING).values_list('id', flat=True)[:100])
+            for task_id in task_ids:
+                run_image_task(task_id)
+            if task_ids:
+                print(f'Processed {len(task_ids)} tasks')
+            elif kwargs['once']:
+                return
+            else:
+                time.sleep(kwargs['sleep'])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Recount favorites_count and in_carts_count of recipes'
+
+    def handle(self, *args, **kwargs):
+        fixed = Recipe.objects.reconcile_counters()
+        print(f'Fixed counters of {fixed} recipes')
@@ -0,0 +1,256 @@
+import io
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from api.cache import bump_versions
+from api.membership import MEMBERSHIP_MODELS
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from PIL import Image
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientAmount,
+                            MediaFile, Recipe, ShoppingCart, Tag)
+from user.models import Subscribe, User
+
+TAGS = (
+    ('Завтрак', Tag.ORANGE, 'breakfast'),
+    ('Обед', Tag.GREEN, 'lunch'),
+    ('Ужин', Tag.PURPLE, 'dinner'),
+)
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Омлет', 'Паста', 'Каша',
+          'Запеканка', 'Блины', 'Плов', 'Котлеты', 'Торт')
+ADJECTIVES = ('домашний', 'быстрый', 'летний', 'пряный', 'бабушкин',
+              'острый', 'легкий', 'сытный', 'праздничный', 'овощной')
+# Даты рецептов отсчитываются от фиксированного момента: одинаковый
+# --seed дает одинаковые данные независимо от дня запуска.
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+WORDS = ('нарезать', 'смешать', 'обжарить', 'посолить', 'запечь',
+         'варить', 'остудить', 'подавать', 'добавить', 'взбить')
+
+
+def zipf_weights(size, alpha):
+    '''Накопленные веса степенного распределения: элемент с рангом r
+    выбирается с вероятностью, пропорциональной 1 / r ** alpha.'''
+    return list(accumulate(1 / rank ** alpha for rank in range(1, size + 1)))
+
+
+@contextmanager
+def manual_dates(model, *fields):
+    '''Отключает auto_now и auto_now_add, чтобы задать даты самим.'''
+    fields = [model._meta.get_field(name) for name in fields]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Generate a deterministic synthetic dataset with power-law '
+            'popularity for performance testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--subscriptions', type=float, default=5,
+            help='Mean subscriptions per user')
+        parser.add_argument(
+            '--favorites', type=float, default=10,
+            help='Mean favorites per user')
+        parser.add_argument(
+            '--carts', type=float, default=2,
+            help='Mean recipes in a shopping cart per user')
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Power-law exponent of author and recipe popularity')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.prefix = f'seed{options["seed"]}'
+        started = time.perf_counter()
+
+        if not Ingredient.objects.exists():
+            call_command('ingredients',
+                         os.path.join(settings.BASE_DIR, 'ingredients.json'))
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})
+
+        self.step('users', self.create_users)
+        self.step('recipes', self.create_recipes)
+        self.step('subscriptions', self.create_subscriptions)
+        self.step('favorites and carts', self.create_lists)
+        self.step('counters', Recipe.objects.reconcile_counters)
+        self.step('shopping lists',
+                  lambda: call_command('shopping_list', verbosity=0))
+        # bulk_create не отправляет сигналы, кэши сбрасываются явно,
+        # теми же метками версий, что и в api/signals.py.
+        bump_versions(
+            [('recipes',), ('profiles',), ('search', 'recipes'),
+             ('catalog', 'tags'), ('catalog', 'ingredients')]
+            + [('recipe', recipe_id) for recipe_id in self.recipe_ids]
+            + [parts for user_id in self.user_ids for parts in (
+                ('user', user_id), ('profile', user_id),
+                *(('membership', kind, user_id)
+                  for kind in MEMBERSHIP_MODELS))]
+        )
+        print(f'Done in {time.perf_counter() - started:.1f}s')
+
+    def step(self, title, function):
+        started = time.perf_counter()
+        result = function()
+        print(f'{title}: {result if result is not None else "ok"} '
+              f'({time.perf_counter() - started:.1f}s)')
+
+    def bulk_create(self, model, objects):
+        for start in range(0, len(objects), self.batch_size):
+            model.objects.bulk_create(
+                objects[start:start + self.batch_size],
+                ignore_conflicts=True)
+
+    def pareto_count(self, mean, limit):
+        # Распределение Парето с alpha=2 имеет среднее 2.
+        return min(int(mean / 2 * self.rng.paretovariate(2)), limit)
+
+    def create_users(self):
+        password = make_password(f'{self.prefix}-password')
+        first = User.objects.filter(
+            username__startswith=f'{self.prefix}_').count()
+        users = [
+            User(username=f'{self.prefix}_{number}',
+                 email=f'{self.prefix}_{number}@example.com',
+                 first_name='Тест', last_name=f'Пользователь {number}',
+                 password=password)
+            for number in range(first, self.options['users'])
+        ]
+        self.bulk_create(User, users)
+        self.user_ids = list(User.objects.filter(
+            username__startswith=f'{self.prefix}_'
+        ).order_by('id').values_list('id', flat=True))
+        # Популярность авторов: несколько очень плодовитых и длинный хвост.
+        self.authors = self.user_ids[:]
+        self.rng.shuffle(self.authors)
+        self.author_weights = zipf_weights(
+            len(self.authors), self.options['alpha'])
+        return len(users)
+
+    def get_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (480, 360), (230, 180, 120)).save(buffer, 'JPEG')
+        return default_storage.save(
+            'recipe/seed.jpg', ContentFile(buffer.getvalue()))
+
+    def create_recipes(self):
+        rng = self.rng
+        image = self.get_image()
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        rng.shuffle(ingredient_ids)
+        ingredient_weights = zipf_weights(len(ingredient_ids), 0.8)
+        total = self.options['recipes']
+        created = 0
+        with manual_dates(Recipe, 'pub_date', 'updated_at'):
+            for start in range(0, total, self.batch_size):
+                count = min(self.batch_size, total - start)
+                authors = rng.choices(self.authors,
+                                      cum_weights=self.author_weights,
+                                      k=count)
+                recipes = []
+                for number, author_id in enumerate(authors, start):
+                    pub_date = EPOCH + timedelta(
+                        seconds=number * 60 + rng.randrange(60))
+                    recipes.append(Recipe(
+                        author_id=author_id,
+                        name=(f'{rng.choice(DISHES)} '
+                              f'{rng.choice(ADJECTIVES)} {number}'),
+                        text=' '.join(rng.choices(WORDS, k=20)),
+                        cooking_time=rng.randint(5, 180),
+                        image=image,
+                        image_thumbnail=image,
+                        image_detail=image,
+                        pub_date=pub_date,
+                        updated_at=pub_date
+                    ))
+                recipes = Recipe.objects.bulk_create(recipes)
+                amounts = []
+                tags = []
+                for recipe in recipes:
+                    chosen = set(rng.choices(
+                        ingredient_ids, cum_weights=ingredient_weights,
+                        k=rng.randint(3, 12)))
+                    amounts += [
+                        IngredientAmount(recipe_id=recipe.id,
+                                         ingredient_id=ingredient_id,
+                                         amount=rng.randint(1, 500))
+                        for ingredient_id in chosen
+                    ]
+                    tags += [
+                        Recipe.tags.through(recipe_id=recipe.id,
+                                            tag_id=tag_id)
+                        for tag_id in rng.sample(
+                            tag_ids, rng.randint(1, len(tag_ids)))
+                    ]
+                self.bulk_create(IngredientAmount, amounts)
+                self.bulk_create(Recipe.tags.through, tags)
+                created += len(recipes)
+        # Все рецепты ссылаются на одну картинку тремя полями.
+        MediaFile.objects.bulk_create([MediaFile(name=image)],
+                                      ignore_conflicts=True)
+        MediaFile.objects.filter(name=image).update(
+            refs=F('refs') + created * 3)
+        self.recipe_ids = list(Recipe.objects.filter(
+            author_id__in=self.user_ids).values_list('id', flat=True))
+        self.rng.shuffle(self.recipe_ids)
+        self.recipe_weights = zipf_weights(
+            len(self.recipe_ids), self.options['alpha'])
+        return created
+
+    def create_subscriptions(self):
+        subscriptions = []
+        for user_id in self.user_ids:
+            count = self.pareto_count(self.options['subscriptions'],
+                                      len(self.authors) - 1)
+            authors = set(self.rng.choices(
+                self.authors, cum_weights=self.author_weights, k=count))
+            subscriptions += [Subscribe(user_id=user_id, author_id=author_id)
+                              for author_id in authors
+                              if author_id != user_id]
+        self.bulk_create(Subscribe, subscriptions)
+        return len(subscriptions)
+
+    def create_lists(self):
+        created = 0
+        for model, mean in ((FavoriteRecipe, self.options['favorites']),
+                            (ShoppingCart, self.options['carts'])):
+            rows = []
+            for user_id in self.user_ids:
+                count = self.pareto_count(mean, len(self.recipe_ids))
+                rows += [
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for recipe_id in set(self.rng.choices(
+                        self.recipe_ids, cum_weights=self.recipe_weights,
+                        k=count))
+                ]
+                if len(rows) >= self.batch_size:
+                    self.bulk_create(model, rows)
+                    created += len(rows)
+                    rows = []
+            self.bulk_create(model, rows)
+            created += len(rows)
+        return created
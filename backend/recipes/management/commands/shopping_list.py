@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from recipes.models import IngredientAmount, ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify aggregated shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report users with mismatched shopping lists'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Users per rebuild batch'
+        )
+
+    def handle(self, *args, **kwargs):
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list(
+                'user_id', flat=True).order_by().distinct())
+            | set(ShoppingListItem.objects.values_list(
+                'user_id', flat=True).order_by().distinct())
+        )
+        if kwargs['verify']:
+            self.verify(user_ids)
+            return
+        batch_size = kwargs['batch_size']
+        changed = 0
+        for start in range(0, len(user_ids), batch_size):
+            changed += ShoppingListItem.objects.refresh(
+                user_ids[start:start + batch_size])
+        print(f'Rebuilt shopping lists of {len(user_ids)} users, '
+              f'{changed} items changed')
+
+    def verify(self, user_ids):
+        expected = set(IngredientAmount.objects.filter(
+            recipe__purchase__isnull=False
+        ).values_list(
+            'recipe__purchase__user_id', 'ingredient_id'
+        ).annotate(total=Sum('amount')).order_by())
+        stored = set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'))
+        broken = {row[0] for row in expected ^ stored}
+        if broken:
+            raise CommandError(
+                f'Shopping lists differ for {len(broken)} users: '
+                f'{sorted(broken)[:20]}')
+        print(f'Shopping lists of {len(user_ids)} users are consistent')
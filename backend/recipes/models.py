@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
-from django.db import models
-from user.models import User
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce, RowNumber
+from django.dispatch import Signal
+from user.models import Subscribe, User
 
 
 class Tag(models.Model):
@@ -64,6 +69,77 @@ class Ingredient(models.Model):
         return f'{self.name} ({self.measurement_unit})'
 
 
+# Счетчики избранного и корзины изменены в обход save(): recipe_ids.
+counters_changed = Signal()
+
+
+class RecipeManager(models.Manager):
+
+    def latest_by_authors(self, author_ids, limit, fields=None):
+        '''Последние limit рецептов каждого автора одним запросом.
+
+        Django не умеет фильтровать по оконной функции, поэтому
+        запрос с ROW_NUMBER() оборачивается в подзапрос.
+        '''
+        author_ids = list(author_ids)
+        result = {author_id: [] for author_id in author_ids}
+        if not author_ids or limit <= 0:
+            return result
+        queryset = self.filter(author_id__in=author_ids).order_by()
+        if fields is not None:
+            queryset = queryset.only('author_id', 'pub_date', *fields)
+        ranked = queryset.annotate(recipe_rank=models.Window(
+            expression=RowNumber(),
+            partition_by=[models.F('author_id')],
+            order_by=[models.F('pub_date').desc(), models.F('id').desc()]
+        ))
+        sql, params = ranked.query.sql_with_params()
+        recipes = self.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE ranked.recipe_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.recipe_rank',
+            (*params, limit)
+        )
+        for recipe in recipes:
+            result[recipe.author_id].append(recipe)
+        return result
+
+    def change_counters(self, recipe_ids, field, delta):
+        '''Атомарно меняет счетчик favorites_count или in_carts_count.'''
+        recipes = self.filter(id__in=recipe_ids)
+        if delta < 0:
+            # Разошедшийся счетчик не должен уходить ниже нуля.
+            recipes = recipes.filter(**{f'{field}__gte': -delta})
+        recipes.update(
+            **{field: models.F(field) + delta})
+        counters_changed.send(sender=self.model, recipe_ids=recipe_ids)
+
+    def reconcile_counters(self):
+        '''Пересчитывает счетчики там, где они разошлись с таблицами
+        избранного и корзины. Возвращает число исправленных рецептов.'''
+        actual = {
+            field: Coalesce(models.Subquery(
+                model.objects.filter(
+                    recipe=models.OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    count=models.Count('id')).values('count')
+            ), 0)
+            for field, model in (('favorites_count', FavoriteRecipe),
+                                 ('in_carts_count', ShoppingCart))
+        }
+        wrong = list(self.annotate(
+            actual_favorites=actual['favorites_count'],
+            actual_in_carts=actual['in_carts_count']
+        ).exclude(
+            favorites_count=models.F('actual_favorites'),
+            in_carts_count=models.F('actual_in_carts')
+        ).values_list('id', flat=True))
+        for start in range(0, len(wrong), 1000):
+            self.filter(id__in=wrong[start:start + 1000]).update(**actual)
+        if wrong:
+            counters_changed.send(sender=self.model, recipe_ids=wrong)
+        return len(wrong)
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -76,6 +152,18 @@ class Recipe(models.Model):
         upload_to='recipe',
         help_text='Загрузите фотографию'
     )
+    image_thumbnail = models.ImageField(
+        'Миниатюра для карточки',
+        upload_to='recipe/thumbnail',
+        blank=True,
+        editable=False
+    )
+    image_detail = models.ImageField(
+        'Картинка для страницы рецепта',
+        upload_to='recipe/detail',
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         'Описание процесса приготовления',
         max_length=1000,
@@ -108,16 +196,100 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    # Заполняется триггером PostgreSQL из name (вес A) и text (вес B).
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    # Разослан ли рецепт в ленты подписчиков (FeedEntry). Рецепты авторов
+    # с большим числом подписчиков не рассылаются и читаются из ленты
+    # напрямую.
+    feed_fanout = models.BooleanField(
+        'Разослан в ленты',
+        default=False,
+        editable=False
+    )
+    # Меняются F-выражениями при добавлении в избранное и корзину,
+    # сверяются командой reconcile_counters.
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_feed_pull_idx',
+                         condition=models.Q(feed_fanout=False)),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+        ]
 
     def __str__(self):
         return f'Автор: {self.author.username} рецепт: {self.name}'
 
 
+class ImageTask(models.Model):
+    '''Задача фоновой обработки картинки рецепта.'''
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (PROCESSING, 'Обрабатывается'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_tasks',
+        verbose_name='Рецепт'
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'Обработка картинки'
+        verbose_name_plural = 'Обработка картинок'
+
+    def __str__(self):
+        return f'Картинка рецепта {self.recipe_id}: {self.status}'
+
+
 class IngredientAmount(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -146,6 +318,48 @@ class IngredientAmount(models.Model):
                 f'{self.ingredient.measurement_unit} {self.ingredient.name}')
 
 
+class UserRecipeManager(models.Manager):
+    '''Избранное и корзина: вставка сообщает, какие строки добавлены
+    на самом деле, поэтому параллельные запросы не считаются дважды.'''
+
+    def add(self, user_id, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        user = quote(meta.get_field('user').column)
+        recipe = quote(meta.get_field('recipe').column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(meta.db_table)} ({user}, {recipe}) '
+                f'VALUES {", ".join(["(%s, %s)"] * len(recipe_ids))} '
+                f'ON CONFLICT ({user}, {recipe}) DO NOTHING '
+                f'RETURNING {recipe}',
+                [value for pk in recipe_ids for value in (user_id, pk)]
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def remove(self, user_id, recipe_ids):
+        '''Удаляет строки одним запросом без сигналов post_delete и
+        возвращает id реально удаленных рецептов.'''
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        recipe = quote(meta.get_field('recipe').column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(meta.db_table)} '
+                f'WHERE {quote(meta.get_field("user").column)} = %s '
+                f'AND {recipe} IN ({", ".join(["%s"] * len(recipe_ids))}) '
+                f'RETURNING {recipe}',
+                [user_id, *recipe_ids]
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+
 class FavoriteRecipe(models.Model):
     user = models.ForeignKey(
         User,
@@ -160,6 +374,8 @@ class FavoriteRecipe(models.Model):
         verbose_name='Избранный рецепт'
     )
 
+    objects = UserRecipeManager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -188,6 +404,8 @@ class ShoppingCart(models.Model):
         verbose_name='Покупка'
     )
 
+    objects = UserRecipeManager()
+
     class Meta:
         ordering = ('id',)
         verbose_name = 'Список покупок'
@@ -200,3 +418,224 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return (f'Пользователь: {self.user.username},'
                 f'рецепт в списке: {self.recipe.name}')
+
+
+class ShoppingListItemManager(models.Manager):
+
+    def refresh(self, user_ids, ingredient_ids=None, recipe_ids=None):
+        '''Пересчитывает суммы ингредиентов в списках покупок.
+
+        Пересчет можно ограничить ингредиентами или ингредиентами
+        указанных рецептов. Возвращает число измененных позиций.
+        '''
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return 0
+        totals = IngredientAmount.objects.filter(
+            recipe__purchase__user_id__in=user_ids)
+        items = self.filter(user_id__in=user_ids)
+        if recipe_ids is not None:
+            ingredient_ids = IngredientAmount.objects.filter(
+                recipe_id__in=recipe_ids).values('ingredient_id')
+        if ingredient_ids is not None:
+            totals = totals.filter(ingredient_id__in=ingredient_ids)
+            items = items.filter(ingredient_id__in=ingredient_ids)
+        with transaction.atomic(using=self.db):
+            # Блокировка пользователей не дает параллельным пересчетам
+            # одного списка вставить одинаковые позиции.
+            list(User.objects.select_for_update().filter(
+                id__in=user_ids).order_by('id').values_list('id'))
+            expected = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in totals.values_list(
+                    'recipe__purchase__user_id', 'ingredient_id'
+                ).annotate(total=models.Sum('amount')).order_by()
+            }
+            to_update = []
+            to_delete = []
+            for item in items.select_for_update():
+                total = expected.pop((item.user_id, item.ingredient_id),
+                                     None)
+                if total is None:
+                    to_delete.append(item.id)
+                elif total != item.amount:
+                    item.amount = total
+                    to_update.append(item)
+            self.filter(id__in=to_delete).delete()
+            self.bulk_update(to_update, ['amount'])
+            self.bulk_create([
+                ShoppingListItem(user_id=user_id,
+                                 ingredient_id=ingredient_id,
+                                 amount=total)
+                for (user_id, ingredient_id), total in expected.items()
+            ])
+        return len(to_delete) + len(to_update) + len(expected)
+
+
+class ShoppingListItem(models.Model):
+    '''Сумма ингредиента по всем рецептам в корзине пользователя.
+
+    Поддерживается при изменении корзины и состава рецептов,
+    сверяется командой shopping_list.
+    '''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique shopping list item')]
+
+    def __str__(self):
+        return (f'Пользователь: {self.user.username}, '
+                f'{self.ingredient.name} {self.amount}')
+
+
+class MediaFileManager(models.Manager):
+
+    def acquire(self, names):
+        '''Увеличивает число ссылок на файлы. Одинаковые картинки хранятся
+        одним файлом (ContentAddressedStorage), поэтому файл удаляется
+        только когда на него не ссылается ни один рецепт.'''
+        names = [name for name in names if name]
+        if not names:
+            return
+        self.bulk_create([self.model(name=name) for name in set(names)],
+                         ignore_conflicts=True)
+        for name in names:
+            self.filter(name=name).update(refs=models.F('refs') + 1)
+
+    def release(self, names):
+        names = [name for name in names if name]
+        if not names:
+            return
+        for name in names:
+            self.filter(name=name, refs__gt=0).update(
+                refs=models.F('refs') - 1)
+        transaction.on_commit(lambda: self.collect(names))
+
+    def collect(self, names):
+        '''Удаляет файлы без ссылок. Строка блокируется, чтобы не удалить
+        файл, который в это время получил новую ссылку.'''
+        for name in set(names):
+            with transaction.atomic():
+                media = self.select_for_update().filter(
+                    name=name, refs=0).first()
+                if media is not None:
+                    default_storage.delete(name)
+                    media.delete()
+
+
+class MediaFile(models.Model):
+    '''Счетчик ссылок рецептов на файл в хранилище.'''
+    name = models.CharField('Путь к файлу', max_length=255, unique=True)
+    refs = models.PositiveIntegerField('Число ссылок', default=0)
+
+    objects = MediaFileManager()
+
+    class Meta:
+        ordering = ('name',)
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.refs})'
+
+
+class FeedEntryManager(models.Manager):
+
+    def fan_out(self, recipe):
+        '''Рассылает новый рецепт в ленты подписчиков автора. Если
+        подписчиков больше FEED_FANOUT_MAX_FOLLOWERS, рецепт остается
+        неразосланным и попадает в ленты при чтении.'''
+        limit = settings.FEED_FANOUT_MAX_FOLLOWERS
+        follower_ids = list(Subscribe.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('user_id', flat=True)[:limit + 1])
+        if len(follower_ids) > limit:
+            return False
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(user_id=user_id, recipe_id=recipe.id,
+                            author_id=recipe.author_id,
+                            pub_date=recipe.pub_date)
+                 for user_id in follower_ids],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+            Recipe.objects.filter(id=recipe.id).update(feed_fanout=True)
+        recipe.feed_fanout = True
+        return True
+
+    def follow(self, user_id, author_id):
+        '''Добавляет в ленту последние разосланные рецепты автора.'''
+        recipes = Recipe.objects.filter(
+            author_id=author_id, feed_fanout=True
+        ).order_by('-pub_date', '-id').values_list(
+            'id', 'pub_date')[:settings.FEED_BACKFILL_LIMIT]
+        self.bulk_create(
+            [self.model(user_id=user_id, recipe_id=recipe_id,
+                        author_id=author_id, pub_date=pub_date)
+             for recipe_id, pub_date in recipes],
+            ignore_conflicts=True
+        )
+
+    def unfollow(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+
+class FeedEntry(models.Model):
+    '''Рецепт автора в ленте подписчика (рассылка при записи).'''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        ordering = ('-pub_date', '-recipe')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique feed entry')]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_entry_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'Лента {self.user_id}: рецепт {self.recipe_id}'
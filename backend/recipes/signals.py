@@ -0,0 +1,78 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from user.models import Subscribe
+
+from .feed import enqueue_fan_out
+from .models import FavoriteRecipe, FeedEntry, MediaFile, Recipe, ShoppingCart
+
+COUNTERS = {
+    FavoriteRecipe: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+IMAGE_FIELDS = ('image', 'image_thumbnail', 'image_detail')
+
+
+def get_image_names(recipe):
+    deferred = recipe.get_deferred_fields()
+    return {field: getattr(recipe, field).name for field in IMAGE_FIELDS
+            if field not in deferred}
+
+
+@receiver(post_init, sender=Recipe)
+def remember_images(sender, instance, **kwargs):
+    instance._image_names = get_image_names(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_images_saved(sender, instance, created, update_fields=None,
+                        **kwargs):
+    # Ссылки пересчитываются по разнице старых и новых путей картинок.
+    old = {} if created else instance._image_names
+    new = get_image_names(instance)
+    if update_fields is not None:
+        new = {field: name for field, name in new.items()
+               if field in update_fields}
+    changed = [field for field, name in new.items()
+               if old.get(field) != name]
+    MediaFile.objects.acquire([new[field] for field in changed])
+    MediaFile.objects.release(
+        [old[field] for field in changed if field in old])
+    instance._image_names = {**old, **new}
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_images_deleted(sender, instance, **kwargs):
+    MediaFile.objects.release(instance._image_names.values())
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        enqueue_fan_out(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribed(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def unsubscribed(sender, instance, **kwargs):
+    FeedEntry.objects.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+def counted_added(sender, instance, created, **kwargs):
+    if created:
+        Recipe.objects.change_counters(
+            [instance.recipe_id], COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+def counted_removed(sender, instance, **kwargs):
+    Recipe.objects.change_counters(
+        [instance.recipe_id], COUNTERS[sender], -1)
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+from .models import MediaFile
+
+# recipe/ab/cd/<sha256>.webp, recipe/thumbnail/ab/cd/<sha256>.webp
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+
+
+def get_content_hash(content):
+    sha256 = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return sha256.hexdigest()
+
+
+def get_hashed_name(name, content_hash):
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, content_hash[:2], content_hash[2:4],
+                        f'{content_hash}{extension}')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Файлы хранятся под sha256 содержимого: повторная загрузка той же
+    картинки не создает копию, а содержимое по адресу не меняется,
+    поэтому nginx отдает такие файлы с кэшированием навсегда.
+
+    Удалять файлы можно только через MediaFile, который считает ссылки.
+    '''
+
+    def pin(self, name):
+        '''Временная ссылка на файл до конца транзакции. Без нее
+        MediaFile.collect мог бы удалить файл без ссылок между проверкой
+        exists() и записью рецепта, который на него сошлется.'''
+        if not connection.in_atomic_block:
+            return
+        # acquire ждет блокировку строки, если collect как раз удаляет
+        # этот файл, и после его коммита exists() вернет False.
+        MediaFile.objects.acquire([name])
+        transaction.on_commit(lambda: MediaFile.objects.release([name]))
+
+    def _save(self, name, content):
+        name = get_hashed_name(name, get_content_hash(content))
+        self.pin(name)
+        if self.exists(name):
+            return name
+        # Одновременные загрузки одной картинки пишут каждая в свой
+        # временный файл, os.replace атомарно подменяет одинаковое
+        # содержимое.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
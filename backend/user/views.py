@@ -1,4 +1,8 @@
-from api.serializers import GetUserSerializer, SubscribeListSerializer
+from api.cache import get_version
+from api.pagination import CachedCountPagination
+from api.serializers import (GetUserSerializer, SubscribeListSerializer,
+                             get_recipes_by_author, get_recipes_limit)
+from django.db.models import Count
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
@@ -14,6 +18,13 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = GetUserSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = CachedCountPagination
+
+    def get_count_cache_key(self):
+        if self.action != 'subscriptions':
+            return None
+        user = self.request.user
+        return ['subscriptions', user.id, get_version('user', user.id)]
 
     @action(
         permission_classes=(IsAuthenticated,),
@@ -50,11 +61,19 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(subscribing__user=user)
+        queryset = User.objects.filter(
+            subscribing__user=user
+        ).annotate(recipes_count=Count('recipes')).order_by('id')
         page = self.paginate_queryset(queryset)
         serializer = SubscribeListSerializer(
             page,
             many=True,
-            context={'request': request}
+            context={
+                'request': request,
+                'recipes_by_author': get_recipes_by_author(
+                    [author.id for author in page],
+                    get_recipes_limit(request)
+                )
+            }
         )
         return self.get_paginated_response(serializer.data)